@@ -0,0 +1,261 @@
+"""Throughput and latency benchmarks of the generator and the executors.
+
+    python bench.py -o bench.json              # run and save the results
+    python bench.py --compare bench.json       # run and compare to a baseline
+
+Every benchmark reports operations per second and the p50/p99 latency of a
+single operation. Execution backends whose binaries are not built are
+skipped. The pool backends overlap execution with the next input, so their
+latency is that of a submission. Coverage counters of the backends go to a
+temporary directory, so the benchmark does not change the coverage of the
+build directory."""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from grammar import Store, TableRecord, store
+from fuzzer import Fuzzer, MyFuzzer
+
+STORE_SIZES = [10, 1000, 100000]
+BACKENDS = ["shell", "pool", "library", "forkserver"]
+
+
+def measure(operation, n):
+    """Call `operation` n times and summarize the latencies."""
+    latencies = []
+    clock = time.perf_counter_ns
+    tic = clock()
+    for _ in range(n):
+        start = clock()
+        operation()
+        latencies.append(clock() - start)
+    total = clock() - tic
+    latencies.sort()
+    return {
+        "n": n,
+        "ops_per_sec": n / (total / 1e9),
+        "p50_us": latencies[n // 2] / 1e3,
+        "p99_us": latencies[min(n - 1, n * 99 // 100)] / 1e3,
+    }
+
+
+def bench_fuzzer(results, scale, profile_file=None):
+    # The phases of fuzz_one_input switch at 50 and 100 inputs.
+    store.clear()
+    fuzzer = Fuzzer()
+    results["fuzz_one_input/phase-1"] = measure(fuzzer.fuzz_one_input, 50)
+    results["fuzz_one_input/phase-2"] = measure(fuzzer.fuzz_one_input, 50)
+    results["fuzz_one_input/phase-3"] = measure(fuzzer.fuzz_one_input, 2000 * scale)
+    if profile_file is not None:
+        profile = fuzzer.generator.enable_profiling()
+        for _ in range(2000 * scale):
+            fuzzer.fuzz_one_input()
+        fuzzer.generator.disable_profiling()
+        print("CompiledGenerator, phase 3")
+        print(profile.summary())
+
+    # The fuzzingbook expansion, on a schema made by the phases above
+    my_fuzzer = MyFuzzer(fuzzer.fuzzer.grammar)
+    results["MyFuzzer.fuzz_tree"] = measure(my_fuzzer.fuzz_tree, 100 * scale)
+    if profile_file is not None:
+        profile = my_fuzzer.enable_profiling()
+        for _ in range(100 * scale):
+            my_fuzzer.fuzz_tree()
+        my_fuzzer.disable_profiling()
+        print("MyFuzzer.fuzz_tree")
+        print(profile.summary())
+        profile.write_collapsed(profile_file)
+    store.clear()
+
+
+def fill_store(size):
+    s = Store()
+    for i in range(size):
+        table_name = f"t{i}"
+        s.set_table(table_name, TableRecord())
+        for j in range(5):
+            s.add_column(table_name, f"c{j}", "INTEGER")
+        if i % 10 == 0:
+            s.add_index(table_name, f"i{i}")
+    return s
+
+
+def bench_store(results, scale):
+    for size in STORE_SIZES:
+        s = fill_store(size)
+        names = [f"t{random.randrange(size)}" for _ in range(1024)]
+        picks = iter(names * (100 * scale))
+        prefix = f"Store/{size}"
+        results[f"{prefix}/get_random_table_name"] = measure(s.get_random_table_name, 10000 * scale)
+        results[f"{prefix}/get_random_column_name"] = measure(
+            lambda: s.get_random_column_name(next(picks)), 10000 * scale
+        )
+        results[f"{prefix}/has_column"] = measure(
+            lambda: s.has_column(next(picks), "c3"), 10000 * scale
+        )
+        results[f"{prefix}/get_random_index"] = measure(s.get_random_index, 10000 * scale)
+
+        counter = iter(range(10**9))
+
+        def add_remove_column():
+            table_name = next(picks)
+            s.add_column(table_name, "x")
+            s.remove_column(table_name, "x")
+
+        def create_drop_table():
+            table_name = f"n{next(counter)}"
+            s.set_table(table_name, TableRecord())
+            s.remove_table(table_name)
+
+        def rename_table():
+            table_name = f"t{next(counter) % size}"
+            s.rename_table(table_name, table_name + "_")
+            s.rename_table(table_name + "_", table_name)
+
+        results[f"{prefix}/add_remove_column"] = measure(add_remove_column, 10000 * scale)
+        results[f"{prefix}/create_drop_table"] = measure(create_drop_table, 10000 * scale)
+        results[f"{prefix}/rename_table"] = measure(rename_table, 10000 * scale)
+
+
+def bench_backends(results, scale, backends):
+    import run
+
+    class Experiment(run.Experiment):
+        def check_output(self, sqlcmd, output, new_edges=None):
+            pass
+
+    store.clear()
+    fuzzer = Fuzzer()
+    inputs = [fuzzer.fuzz_one_input() for _ in range(200 * scale)]
+    for backend in backends:
+        store.clear()
+        with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+            try:
+                experiment = Experiment(
+                    backend=backend,
+                    db_file=os.path.join(directory, "bench.db"),
+                    gcov_prefix=directory,
+                )
+            except FileNotFoundError as e:
+                print(f"skipping {backend}: {e}", file=sys.stderr)
+                continue
+            pending = iter(inputs)
+            try:
+                results[f"Experiment.run/{backend}"] = measure(
+                    lambda: experiment.run(next(pending)), len(inputs)
+                )
+            except FileNotFoundError as e:
+                print(f"skipping {backend}: {e}", file=sys.stderr)
+            experiment.flush()
+            experiment.close()
+    store.clear()
+
+
+def compare(results, baseline, threshold):
+    """Print the change against `baseline` and return the names of the
+    benchmarks that lost more than `threshold` of their throughput."""
+    regressions = []
+    print(f"{'benchmark':<48}{'baseline':>12}{'now':>12}{'change':>9}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["ops_per_sec"]
+        after = result["ops_per_sec"]
+        change = after / before - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  <-- slower"
+        print(f"{name:<48}{before:>12.0f}{after:>12.0f}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generator and executor benchmarks")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare to the results in this JSON file")
+    parser.add_argument(
+        "--threshold",
+        default=0.2,
+        type=float,
+        help="With --compare, fail if a throughput dropped by more than this fraction (default: 0.2)",
+    )
+    parser.add_argument(
+        "--only",
+        default="fuzzer,store,backends",
+        help="Comma-separated groups to run: fuzzer, store, backends (default: all)",
+    )
+    parser.add_argument(
+        "--backends",
+        default=",".join(BACKENDS),
+        help="Comma-separated execution backends to measure (default: all that are built)",
+    )
+    parser.add_argument(
+        "--scale", default=1, type=int, help="Multiply the number of iterations"
+    )
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Profile the generator and MyFuzzer.fuzz_tree per nonterminal, and write MyFuzzer's collapsed stacks for flamegraph.pl to FILE",
+    )
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    groups = args.only.split(",")
+    results = {}
+    if "fuzzer" in groups:
+        bench_fuzzer(results, args.scale, args.profile)
+    if "store" in groups:
+        bench_store(results, args.scale)
+    if "backends" in groups:
+        bench_backends(results, args.scale, args.backends.split(","))
+
+    for name, result in results.items():
+        print(
+            f"{name:<48}{result['ops_per_sec']:>12.0f}/s"
+            f"  p50 {result['p50_us']:>9.1f} us  p99 {result['p99_us']:>9.1f} us"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
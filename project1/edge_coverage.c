@@ -0,0 +1,48 @@
+/*
+** Edge coverage runtime for the sqlite3-edges build.
+**
+** Every basic block of shell.c and sqlite3.c is compiled with
+** -fsanitize-coverage=trace-pc, which calls __sanitizer_cov_trace_pc().
+** Like AFL, an edge is the pair of the previous and the current block,
+** hashed into a 64 KiB map of hit counters. If SQLITE_EDGE_MAP names a
+** file of EDGE_MAP_SIZE bytes (usually in /dev/shm), the map is shared
+** with the fuzzer through mmap, so run.py can read it after every input.
+**
+** This file must be compiled without -fsanitize-coverage.
+*/
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#define EDGE_MAP_SIZE (1 << 16)
+
+static uint8_t private_map[EDGE_MAP_SIZE];
+static uint8_t *edge_map = private_map;
+static uintptr_t prev_location;
+
+__attribute__((constructor)) static void edge_map_init(void){
+  const char *path = getenv("SQLITE_EDGE_MAP");
+  void *map;
+  int fd;
+  if( path==0 ) return;
+  fd = open(path, O_RDWR);
+  if( fd<0 ) return;
+  map = mmap(0, EDGE_MAP_SIZE, PROT_READ|PROT_WRITE, MAP_SHARED, fd, 0);
+  close(fd);
+  if( map!=MAP_FAILED ) edge_map = map;
+}
+
+void __sanitizer_cov_trace_pc(void){
+  /* Relative to a function of the binary, so that the same block maps to
+  ** the same location in every process despite address randomization. */
+  uintptr_t location = (uintptr_t)__builtin_return_address(0)
+                     - (uintptr_t)edge_map_init;
+  location = ((location >> 4) ^ (location << 8)) & (EDGE_MAP_SIZE - 1);
+  /* Saturate instead of wrapping around to zero, which would hide the edge. */
+  if( edge_map[location ^ prev_location]!=0xff ){
+    edge_map[location ^ prev_location]++;
+  }
+  prev_location = location >> 1;
+}
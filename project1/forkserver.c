@@ -0,0 +1,92 @@
+/*
+** AFL-style fork server for the sqlite3 binaries, loaded with LD_PRELOAD.
+**
+** The shim wraps __libc_start_main, so that it gets control after the
+** dynamic linking and the constructors of the binary (gcov, edge map),
+** right before main. If FORKSERVER_CTL_FD is set, it then serves test
+** cases instead of running main once:
+**
+**   run.py writes 4 bytes to the control pipe,
+**   the server forks; the child reads its stdin from FORKSERVER_INPUT,
+**     writes stdout and stderr to FORKSERVER_OUTPUT and runs main,
+**   the server writes the child's pid and then its wait status (4 bytes
+**     each) to the status pipe.
+**
+** Children exit through main, so gcov merges their counters into the
+** .gcda files one after the other, and the edge map of the server is
+** shared with them. The server exits when the control pipe is closed.
+**
+** Build: gcc -O2 -shared -fPIC forkserver.c -ldl -o forkserver.so
+*/
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+typedef int (*main_fn)(int, char **, char **);
+
+static main_fn real_main;
+
+static int redirect(const char *path, int flags, int target){
+  int fd = open(path, flags, 0600);
+  if( fd<0 ) return -1;
+  if( fd!=target ){
+    dup2(fd, target);
+    close(fd);
+  }
+  return 0;
+}
+
+static int serve(int argc, char **argv, char **envp){
+  const char *ctl = getenv("FORKSERVER_CTL_FD");
+  const char *status_fd = getenv("FORKSERVER_STATUS_FD");
+  const char *input = getenv("FORKSERVER_INPUT");
+  const char *output = getenv("FORKSERVER_OUTPUT");
+  int ctl_fd, st_fd;
+  uint32_t msg;
+
+  if( ctl==0 || status_fd==0 || input==0 || output==0 ){
+    return real_main(argc, argv, envp);
+  }
+  ctl_fd = atoi(ctl);
+  st_fd = atoi(status_fd);
+
+  while( read(ctl_fd, &msg, 4)==4 ){
+    int status = 0;
+    pid_t pid = fork();
+    if( pid<0 ) _exit(1);
+    if( pid==0 ){
+      close(ctl_fd);
+      close(st_fd);
+      if( redirect(input, O_RDONLY, 0)
+       || redirect(output, O_WRONLY|O_CREAT|O_TRUNC, 1) ){
+        _exit(1);
+      }
+      dup2(1, 2);
+      return real_main(argc, argv, envp);
+    }
+    msg = (uint32_t)pid;
+    if( write(st_fd, &msg, 4)!=4 ) _exit(1);
+    if( waitpid(pid, &status, 0)<0 ) _exit(1);
+    msg = (uint32_t)status;
+    if( write(st_fd, &msg, 4)!=4 ) _exit(1);
+  }
+  /* The server never ran main, so it has no counters worth writing. */
+  _exit(0);
+}
+
+int __libc_start_main(
+  main_fn main, int argc, char **argv,
+  void (*init)(void), void (*fini)(void),
+  void (*rtld_fini)(void), void *stack_end
+){
+  int (*start)(main_fn, int, char **, void (*)(void), void (*)(void),
+               void (*)(void), void *);
+  start = dlsym(RTLD_NEXT, "__libc_start_main");
+  real_main = main;
+  return start(serve, argc, argv, init, fini, rtld_fini, stack_end);
+}
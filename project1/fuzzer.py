@@ -1,8 +1,9 @@
-from typing import Any, Dict, List, Set, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
 from fuzzingbook.GrammarFuzzer import (
     DerivationTree,
     EvenFasterGrammarFuzzer,
     GrammarFuzzer,
+    all_terminals,
     nonterminals,
 )
 from pprint import pprint
@@ -14,11 +15,237 @@ from fuzzingbook.GeneratorGrammarFuzzer import (
     ProbabilisticGrammarFuzzer,
     ProbabilisticGeneratorGrammarCoverageFuzzer,
 )
-from fuzzingbook.GeneratorGrammarFuzzer import exp_order, exp_post_expansion_function
-from fuzzingbook.Grammars import Expansion
+from fuzzingbook.GeneratorGrammarFuzzer import (
+    exp_order,
+    exp_post_expansion_function,
+    exp_pre_expansion_function,
+)
+from fuzzingbook.GeneratorGrammarFuzzer import RestartExpansionException
+from fuzzingbook.Grammars import Expansion, RE_NONTERMINAL, is_nonterminal
+from fuzzingbook.ProbabilisticGrammarFuzzer import exp_probabilities
 import grammar
 from grammar import store
-from time import time, sleep
+from time import perf_counter_ns
+from collections import defaultdict
+from bisect import bisect
+import hashlib
+from itertools import accumulate
+import random
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PHASES = ["<phase-1>", "<phase-2>", "<phase-3>"]
+# Phase weights are re-derived from the observed gains every this many inputs.
+PHASE_UPDATE_INTERVAL = 50
+# Inputs whose feedback never arrives are forgotten after this many others.
+MAX_PENDING_INPUTS = 64
+# Share of a session spent creating tables, and creating indices and views,
+# before the mixed workload.
+SESSION_PHASE_SHARES = (0.2, 0.1)
+# First keywords of the statements that InputDedup may drop. The others
+# change the schema model or the transaction state, so they always run.
+DEDUP_KEYWORDS = {
+    "SELECT",
+    "VALUES",
+    "WITH",
+    "INSERT",
+    "REPLACE",
+    "UPDATE",
+    "DELETE",
+    "ANALYZE",
+    "PRAGMA",
+    "EXPLAIN",
+    "VACUUM",
+    "REINDEX",
+}
+SQL_TOKEN = re.compile(
+    r"'(?:[^']|'')*'|0[xX][0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|[A-Za-z_]\w*"
+)
+
+
+# Cost tables of the grammars seen so far, by grammar_hash()
+COST_CACHE: Dict[str, Tuple[Dict[str, float], Dict[str, float]]] = {}
+
+
+def grammar_hash(grammar: Grammar) -> str:
+    # Costs only depend on the expansion strings, not on their options.
+    digest = hashlib.sha1()
+    for symbol in sorted(grammar):
+        digest.update(symbol.encode())
+        for expansion in grammar[symbol]:
+            digest.update(b"\0" + exp_string(expansion).encode())
+        digest.update(b"\1")
+    return digest.hexdigest()
+
+
+def compute_costs(grammar: Grammar) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Minimal derivation costs of all symbols and expansions of `grammar`.
+
+    An expansion costs one plus the costs of its nonterminals, a symbol the
+    cost of its cheapest expansion. Starting from infinite costs, all
+    expansions are relaxed until nothing changes (as in Bellman-Ford), which
+    takes at most one pass per symbol. Symbols that cannot derive a string
+    keep an infinite cost."""
+    expansions = {
+        symbol: [exp_string(expansion) for expansion in grammar[symbol]]
+        for symbol in grammar
+    }
+    symbols_of = {
+        expansion: nonterminals(expansion)
+        for strings in expansions.values()
+        for expansion in strings
+    }
+    symbol_costs = {symbol: float("inf") for symbol in grammar}
+
+    changed = True
+    while changed:
+        changed = False
+        for symbol, strings in expansions.items():
+            cost = min(
+                sum(symbol_costs[s] for s in symbols_of[expansion]) + 1
+                for expansion in strings
+            )
+            if cost < symbol_costs[symbol]:
+                symbol_costs[symbol] = cost
+                changed = True
+
+    expansion_costs = {
+        expansion: sum(symbol_costs[s] for s in symbols) + 1
+        for expansion, symbols in symbols_of.items()
+    }
+    return symbol_costs, expansion_costs
+
+
+def grammar_costs(grammar: Grammar) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """compute_costs(), cached per grammar. The tables are shared, so they
+    must not be changed."""
+    key = grammar_hash(grammar)
+    if key not in COST_CACHE:
+        COST_CACHE[key] = compute_costs(grammar)
+    return COST_CACHE[key]
+
+
+def tree_shape(tree: DerivationTree) -> Tuple[int, int]:
+    """Depth and number of nodes of `tree`."""
+    depth = 0
+    nodes = 0
+    stack = [(tree, 1)]
+    while stack:
+        (_, children), level = stack.pop()
+        nodes += 1
+        depth = max(depth, level)
+        stack.extend((child, level + 1) for child in children or [])
+    return depth, nodes
+
+
+class ExpansionCoverage:
+    """Which expansions of `grammar` have been chosen, one byte per rule id.
+
+    Rule ids number the expansions in grammar order, symbol by symbol, as
+    CompiledGenerator compiles them, so MyFuzzer and the generator of a
+    Fuzzer share one instance."""
+
+    def __init__(self, grammar: Grammar) -> None:
+        self.rule_ids: Dict[str, Dict[str, int]] = {}
+        self.expansions: List[Tuple[str, str]] = []
+        for symbol in grammar:
+            ids = self.rule_ids[symbol] = {}
+            for expansion in grammar[symbol]:
+                ids[exp_string(expansion)] = len(self.expansions)
+                self.expansions.append((symbol, exp_string(expansion)))
+        self.covered = bytearray(len(self.expansions))
+
+    def __len__(self) -> int:
+        return len(self.expansions)
+
+    def count(self) -> int:
+        return len(self.expansions) - self.covered.count(0)
+
+    def uncovered(self) -> List[Tuple[str, str]]:
+        return [e for e, covered in zip(self.expansions, self.covered) if not covered]
+
+
+class Profile:
+    """Where MyFuzzer or CompiledGenerator spends its time, per nonterminal,
+    in nanoseconds.
+
+    `expand_time` includes the subtree below the node, so recursive symbols
+    count their nested occurrences again. `pre_time` and `post_time` are
+    spent in the pre and post functions of the symbol's expansions.
+    `stacks` holds the time spent in each node itself, per path of
+    nonterminals from the root, for flame graphs. CompiledGenerator only
+    records expansions, pre and post time, and the time per input."""
+
+    def __init__(self) -> None:
+        self.expansions: Dict[str, int] = defaultdict(int)
+        self.expand_time: Dict[str, int] = defaultdict(int)
+        self.pre_time: Dict[str, int] = defaultdict(int)
+        self.post_time: Dict[str, int] = defaultdict(int)
+        self.stacks: Dict[Tuple[str, ...], int] = defaultdict(int)
+        # Depth and node count of every input
+        self.depths: List[int] = []
+        self.node_counts: List[int] = []
+        # The nodes being expanded, and the time spent in their children
+        self.path: List[str] = []
+        self.child_time: List[int] = []
+        # Inputs of CompiledGenerator and the time spent generating them
+        self.inputs = 0
+        self.generate_time = 0
+
+    def self_time(self) -> Dict[str, int]:
+        """Time spent in the nodes of each symbol, without their subtrees."""
+        result: Dict[str, int] = defaultdict(int)
+        for stack, elapsed in self.stacks.items():
+            result[stack[-1]] += elapsed
+        return result
+
+    def summary(self, top: int = 20) -> str:
+        """The symbols with the most self time, or without stacks
+        (CompiledGenerator) with the most pre and post time. The total
+        column includes the subtrees, so <start> counts everything."""
+        self_time = self.self_time()
+        lines = [
+            f"{'symbol':<32}{'expansions':>11}{'self ms':>9}{'total ms':>10}"
+            f"{'pre ms':>9}{'post ms':>9}"
+        ]
+        symbols = sorted(
+            self.expansions,
+            key=lambda s: self_time[s] if self.stacks else self.pre_time[s] + self.post_time[s],
+            reverse=True,
+        )
+        for symbol in symbols[:top]:
+            lines.append(
+                f"{symbol:<32}{self.expansions[symbol]:>11}"
+                f"{self_time[symbol] / 1e6:>9.1f}"
+                f"{self.expand_time[symbol] / 1e6:>10.1f}"
+                f"{self.pre_time[symbol] / 1e6:>9.1f}"
+                f"{self.post_time[symbol] / 1e6:>9.1f}"
+            )
+        if self.depths:
+            n = len(self.depths)
+            lines.append(
+                f"{n} inputs, mean depth {sum(self.depths) / n:.1f}, "
+                f"mean nodes {sum(self.node_counts) / n:.1f}"
+            )
+        if self.inputs:
+            lines.append(
+                f"{self.inputs} inputs in {self.generate_time / 1e6:.1f} ms, "
+                f"pre {sum(self.pre_time.values()) / 1e6:.1f} ms, "
+                f"post {sum(self.post_time.values()) / 1e6:.1f} ms"
+            )
+        return "\n".join(lines)
+
+    def write_collapsed(self, path: str) -> None:
+        """Write the stacks in the collapsed format of flamegraph.pl and
+        speedscope, with microseconds as sample counts."""
+        with open(path, "w") as f:
+            for stack, elapsed in sorted(self.stacks.items()):
+                if elapsed >= 1000:
+                    f.write(f"{';'.join(stack)} {elapsed // 1000}\n")
 
 
 class MyFuzzer(ProbabilisticGeneratorGrammarFuzzer):
@@ -27,9 +254,9 @@ class MyFuzzer(ProbabilisticGeneratorGrammarFuzzer):
         grammar: Grammar,
         *,
         replacement_attempts: int = 10,
-        precompute_costs=True,
-        symbol_costs={},
-        expansion_costs={},
+        symbol_costs: Optional[Dict[str, float]] = None,
+        expansion_costs: Optional[Dict[str, float]] = None,
+        coverage: Optional[ExpansionCoverage] = None,
         **kwargs,
     ):
         super(GeneratorGrammarFuzzer, self).__init__(
@@ -40,63 +267,125 @@ class MyFuzzer(ProbabilisticGeneratorGrammarFuzzer):
         # super(GeneratorGrammarFuzzer, self).__init__(grammar, replacement_attempts)
         # super(ProbabilisticGrammarCoverageFuzzer, self).__init__(grammar, **kwargs)
 
-        self._symbol_costs: Dict[str, Union[int, float]] = symbol_costs
-        self._expansion_costs: Dict[Expansion, Union[int, float]] = expansion_costs
+        if symbol_costs is None or expansion_costs is None:
+            symbol_costs, expansion_costs = grammar_costs(grammar)
+        self._symbol_costs: Dict[str, float] = symbol_costs
+        self._expansion_costs: Dict[str, float] = expansion_costs
 
-        if precompute_costs:
-            self.precompute_costs()
+        # exp_probabilities() of every symbol, computed on first use
+        self.probabilities: Dict[str, Dict[str, float]] = {}
+        self.profile: Optional[Profile] = None
+        # Expansions chosen so far, see choose_node_expansion
+        self.coverage = coverage
 
-        # Make sure we now call the caching methods
-        self.symbol_cost = self.new_symbol_cost  # type: ignore
-        self.expansion_cost = self.new_expansion_cost  # type: ignore
+    def enable_profiling(self) -> Profile:
+        """Start recording a Profile. The profiled methods are installed on
+        the instance, so that a fuzzer without profiling runs the plain
+        ones and pays nothing."""
+        self.profile = Profile()
+        self.expand_tree_once = self.profiled_expand_tree_once
+        self.process_chosen_children = self.profiled_process_chosen_children
+        self.eval_function = self.profiled_eval_function
+        self.fuzz_tree = self.profiled_fuzz_tree
+        return self.profile
 
-    def new_symbol_cost(self, symbol: str, seen: Set[str] = set()) -> Union[int, float]:
-        # print("okay...")
-        return self._symbol_costs[symbol]
+    def disable_profiling(self) -> Optional[Profile]:
+        for name in ["expand_tree_once", "process_chosen_children", "eval_function", "fuzz_tree"]:
+            self.__dict__.pop(name, None)
+        profile, self.profile = self.profile, None
+        return profile
 
-    def new_expansion_cost(
-        self, expansion: Expansion, seen: Set[str] = set()
-    ) -> Union[int, float]:
-        # print("okay...")
-        expansion = exp_string(expansion)
-        return self._expansion_costs[expansion]
+    def profiled_expand_tree_once(self, tree: DerivationTree) -> DerivationTree:
+        profile = self.profile
+        symbol, children = tree
+        profile.path.append(symbol)
+        profile.child_time.append(0)
+        start = perf_counter_ns()
+        try:
+            return MyFuzzer.expand_tree_once(self, tree)
+        finally:
+            elapsed = perf_counter_ns() - start
+            profile.stacks[tuple(profile.path)] += elapsed - profile.child_time.pop()
+            profile.path.pop()
+            if profile.child_time:
+                profile.child_time[-1] += elapsed
+            profile.expand_time[symbol] += elapsed
+            if children is None:
+                profile.expansions[symbol] += 1
 
-    def precompute_costs(self) -> None:
-        tic = time()
-        for symbol in self.grammar:
-            if symbol not in self._symbol_costs:
-                self._symbol_costs[symbol] = self.symbol_cost(symbol)
+    def profiled_process_chosen_children(
+        self, children: List[DerivationTree], expansion: Expansion
+    ) -> List[DerivationTree]:
+        # Runs the pre function of the node that is being expanded
+        path = self.profile.path
+        start = perf_counter_ns()
+        try:
+            return MyFuzzer.process_chosen_children(self, children, expansion)
+        finally:
+            symbol = path[-1] if path else "<derive>"
+            self.profile.pre_time[symbol] += perf_counter_ns() - start
 
-            for expansion in self.grammar[symbol]:
-                expansion = exp_string(expansion)
-                if expansion not in self._expansion_costs:
-                    self._expansion_costs[expansion] = self.expansion_cost(expansion)
+    def profiled_eval_function(self, tree: DerivationTree, function: Any) -> Any:
+        # Runs a post function
+        start = perf_counter_ns()
+        try:
+            return MyFuzzer.eval_function(self, tree, function)
+        finally:
+            self.profile.post_time[tree[0]] += perf_counter_ns() - start
 
-        toc = time()
+    def profiled_fuzz_tree(self) -> DerivationTree:
+        tree = MyFuzzer.fuzz_tree(self)
+        depth, nodes = tree_shape(tree)
+        self.profile.depths.append(depth)
+        self.profile.node_counts.append(nodes)
+        return tree
 
-    def symbol_cost(self, symbol: str, seen: Set[str] = set()) -> Union[int, float]:
-        if symbol not in self._symbol_costs:
-            expansions = self.grammar[symbol]
-            self._symbol_costs[symbol] = min(
-                self.expansion_cost(e, seen | {symbol}) for e in expansions
-            )
+    def symbol_cost(self, symbol: str, seen: Optional[Set[str]] = None) -> float:
         return self._symbol_costs[symbol]
 
     def expansion_cost(
-        self, expansion: Expansion, seen: Set[str] = set()
-    ) -> Union[int, float]:
-        expansion = exp_string(expansion)
-        if expansion not in self._expansion_costs:
-            symbols = nonterminals(expansion)
-            if len(symbols) == 0:
-                self._expansion_costs[expansion] = 1  # no symbol
-            elif any(s in seen for s in symbols):
-                self._expansion_costs[expansion] = float("inf")
-            else:
-                self._expansion_costs[expansion] = (
-                    sum(self.symbol_cost(s, seen) for s in symbols) + 1
-                )
-        return self._expansion_costs[expansion]
+        self, expansion: Expansion, seen: Optional[Set[str]] = None
+    ) -> float:
+        return self._expansion_costs[exp_string(expansion)]
+
+    def set_expansions(self, symbol: str, expansions: List[Expansion]) -> None:
+        """Replace the expansions of `symbol` on the live fuzzer, e.g. to give
+        them other probabilities. Their strings must stay the same, since
+        the costs are not recomputed."""
+        self.grammar[symbol] = expansions
+        self.probabilities.pop(symbol, None)
+
+    def choose_node_expansion(
+        self, node: DerivationTree, children_alternatives: List[Any]
+    ) -> int:
+        (symbol, tree) = node
+        probabilities = self.probabilities.get(symbol)
+        if probabilities is None:
+            probabilities = exp_probabilities(self.grammar[symbol], symbol)
+            self.probabilities[symbol] = probabilities
+
+        expansions = [
+            all_terminals((symbol, children)) for children in children_alternatives
+        ]
+        weights = [probabilities[expansion] for expansion in expansions]
+        if sum(weights) == 0:
+            # No alternative (probably expanding at minimum cost)
+            weights = [1.0] * len(weights)
+        if self.coverage is None:
+            return random.choices(range(len(children_alternatives)), weights=weights)[0]
+
+        # Expansions that were never chosen, and may be, go first
+        covered = self.coverage.covered
+        rules = [self.coverage.rule_ids[symbol][expansion] for expansion in expansions]
+        candidates = [
+            i for i, rule in enumerate(rules) if weights[i] > 0 and not covered[rule]
+        ]
+        if candidates:
+            index = random.choice(candidates)
+        else:
+            index = random.choices(range(len(children_alternatives)), weights=weights)[0]
+        covered[rules[index]] = 1
+        return index
 
     def expand_tree_once(self, tree: DerivationTree) -> DerivationTree:
         # Apply inherited method.  This also calls `expand_tree_once()` on all
@@ -178,6 +467,740 @@ class MyFuzzer(ProbabilisticGeneratorGrammarFuzzer):
             tree = GrammarFuzzer.fuzz_tree(self)
             return tree
 
+    def derive(self, symbol: str, expansion: Expansion) -> DerivationTree:
+        """Expand `symbol` with the given `expansion`, running its pre and
+        post functions, and derive the rest of the tree as usual."""
+        children = self.expansion_to_children(expansion)
+        children = self.process_chosen_children(children, expansion)
+        return self.expand_tree((symbol, children))
+
+
+class CompiledGenerator:
+    """Generates inputs from `grammar` without fuzzingbook's tree walks.
+
+    The grammar is compiled into integer-indexed rule tables with cumulative
+    probabilities; expansion then runs off an explicit stack, writing text
+    straight into per-rule buffers. Expansion order, pre and post functions
+    and the switch to min-cost expansion after `max_nonterminals` open
+    symbols behave as in `MyFuzzer`."""
+
+    def __init__(
+        self,
+        grammar: Grammar,
+        expansion_costs: Dict[str, Union[int, float]],
+        start_symbol: str = "<start>",
+        max_nonterminals: int = 10,
+        replacement_attempts: int = 10,
+        coverage: Optional[ExpansionCoverage] = None,
+    ):
+        self.grammar = grammar
+        self.coverage = coverage
+        self.expansion_costs = expansion_costs
+        self.max_nonterminals = max_nonterminals
+        self.replacement_attempts = replacement_attempts
+
+        self.symbols = list(grammar)
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.start = self.symbol_ids[start_symbol]
+
+        # Per rule: owning symbol, expansion string, template buffer (symbol
+        # ids for nonterminals, strings for terminals), nonterminal slots in
+        # expansion order and whether that order is given, nonterminal slots
+        # in textual order, pre and post functions.
+        self.rule_symbols: List[int] = []
+        self.rule_expansions: List[str] = []
+        self.rule_tokens: List[List[Any]] = []
+        self.rule_slots: List[List[int]] = []
+        self.rule_ordered: List[bool] = []
+        self.rule_args: List[List[int]] = []
+        self.rule_pre: List[Any] = []
+        self.rule_post: List[Any] = []
+
+        # Per symbol: its rule ids. Choice tables hold the rule ids and
+        # cumulative weights of the random phase at the symbol id and of the
+        # min-cost phase at the symbol id plus the number of symbols.
+        self.rules: List[List[int]] = []
+        n = len(self.symbols)
+        self.choices: List[List[int]] = [[] for _ in range(2 * n)]
+        self.cum_weights: List[List[float]] = [[] for _ in range(2 * n)]
+
+        # Choices pre-drawn by `reserve`, taken from the end, and how often
+        # a table ran out of them.
+        self.draws: List[List[int]] = [[] for _ in range(2 * n)]
+        self.misses = [0] * (2 * n)
+        self.expected_draws = [0.0] * (2 * n)
+        self.reserved: List[int] = [0] * (2 * n)
+        self.reserved_inputs = 0
+        self.tables = None
+        # Per table: rules with a nonzero weight that may not be covered
+        # yet. They are chosen first, see pop_uncovered.
+        self.uncovered: List[List[int]] = [[] for _ in range(2 * n)]
+        # Choice tables per (symbol, expansions list), see set_probabilities
+        self.probability_cache: Dict[Any, Any] = {}
+        self.rng = None if numpy is None else numpy.random.default_rng(random.getrandbits(64))
+        self.profile: Optional[Profile] = None
+
+        for symbol in self.symbols:
+            rules = []
+            for expansion in grammar[symbol]:
+                rules.append(self.compile_rule(symbol, expansion))
+            self.rules.append(rules)
+            self.set_probabilities(symbol)
+        # Rule ids are the ids of the shared ExpansionCoverage
+        assert coverage is None or len(coverage) == len(self.rule_tokens)
+
+    def compile_rule(self, symbol: str, expansion: Expansion) -> int:
+        string = exp_string(expansion)
+        tokens: List[Any] = []
+        if string == "":
+            tokens.append("")
+        for token in re.split(RE_NONTERMINAL, string):
+            if is_nonterminal(token):
+                tokens.append(self.symbol_ids[token])
+            elif token:
+                tokens.append(token)
+        args = [i for i, token in enumerate(tokens) if isinstance(token, int)]
+
+        order = exp_order(expansion)
+        if order is None:
+            slots = list(args)
+        else:
+            assert len(order) == len(args), "Order must have one element for each nonterminal"
+            slots = [slot for _, slot in sorted(zip(order, args))]
+
+        self.rule_symbols.append(self.symbol_ids[symbol])
+        self.rule_expansions.append(string)
+        self.rule_tokens.append(tokens)
+        self.rule_slots.append(slots)
+        self.rule_ordered.append(order is not None)
+        self.rule_args.append(args)
+        self.rule_pre.append(exp_pre_expansion_function(expansion))
+        self.rule_post.append(exp_post_expansion_function(expansion))
+        return len(self.rule_tokens) - 1
+
+    def set_probabilities(self, symbol: str, expansions: List[Expansion] = None) -> None:
+        """Recompute the choice tables of `symbol` from the `prob` options
+        of `expansions`, which must be the compiled expansions with new
+        options, or of the grammar."""
+        if expansions is not None:
+            self.grammar[symbol] = expansions
+        expansions = self.grammar[symbol]
+        symbol_id = self.symbol_ids[symbol]
+        min_cost_id = symbol_id + len(self.symbols)
+
+        # The cache holds on to the expansions, so their id is not reused
+        key = (symbol_id, id(expansions))
+        cached = self.probability_cache.get(key)
+        if cached is None:
+            rules = self.rules[symbol_id]
+            probabilities = exp_probabilities(expansions, symbol)
+            weights = [probabilities[self.rule_expansions[rule]] for rule in rules]
+            costs = [self.expansion_costs[self.rule_expansions[rule]] for rule in rules]
+
+            min_cost = min(costs)
+            min_cost_rules = [rule for rule, cost in zip(rules, costs) if cost == min_cost]
+            min_cost_weights = [w for w, cost in zip(weights, costs) if cost == min_cost]
+            cached = (
+                expansions,
+                rules,
+                self.cumulate(weights),
+                min_cost_rules,
+                self.cumulate(min_cost_weights),
+            )
+            self.probability_cache[key] = cached
+
+        _, rules, cum_weights, min_cost_rules, min_cost_cum_weights = cached
+        self.choices[symbol_id] = rules
+        self.cum_weights[symbol_id] = cum_weights
+        self.choices[min_cost_id] = min_cost_rules
+        self.cum_weights[min_cost_id] = min_cost_cum_weights
+        self.draws[symbol_id] = []
+        self.draws[min_cost_id] = []
+        if self.coverage is not None:
+            covered = self.coverage.covered
+            for t in (symbol_id, min_cost_id):
+                weights = self.cum_weights[t]
+                self.uncovered[t] = [
+                    rule
+                    for rule, low, high in zip(self.choices[t], [0.0] + weights, weights)
+                    if high > low and not covered[rule]
+                ]
+        if self.tables is not None:
+            # Only the weights changed, so patch the NumPy tables in place
+            offsets, cum, _ = self.tables
+            for t in (symbol_id, min_cost_id):
+                weights = self.cum_weights[t]
+                cum[offsets[t] : offsets[t + 1]] = [t + w / weights[-1] for w in weights]
+
+    def pop_uncovered(self, table: int) -> Optional[int]:
+        """A random rule of `table` that was never chosen, if any is left."""
+        pending = self.uncovered[table]
+        covered = self.coverage.covered
+        while pending:
+            i = int(random.random() * len(pending))
+            pending[i], pending[-1] = pending[-1], pending[i]
+            rule = pending.pop()
+            if not covered[rule]:
+                return rule
+        return None
+
+    @staticmethod
+    def cumulate(weights: List[float]) -> List[float]:
+        if sum(weights) == 0:
+            # No alternative has a probability, choose uniformly
+            weights = [1.0] * len(weights)
+        return list(accumulate(weights))
+
+    def reserve(self, n: int) -> None:
+        """Pre-draw the expansion choices of about `n` inputs with NumPy.
+
+        How many choices each table needs is estimated from the previous
+        reservation. All tables are drawn from in a single call: the
+        normalized cumulative weights of table t are shifted by t, so that
+        one sorted array maps the uniform draws t + u to rule ids."""
+        if self.rng is None:
+            return
+        tables = len(self.choices)
+        draws = self.draws
+        if self.reserved_inputs:
+            for t in range(tables):
+                used = self.reserved[t] - len(draws[t]) + self.misses[t]
+                self.expected_draws[t] = used / self.reserved_inputs
+        self.misses = [0] * tables
+
+        counts = numpy.zeros(tables, dtype=numpy.int64)
+        for t in range(tables):
+            if len(self.choices[t]) > 1:
+                need = int(self.expected_draws[t] * n * 1.25) + 1 - len(draws[t])
+                if need > 0:
+                    counts[t] = need
+        if counts.any():
+            offsets, cum, rules = self.draw_tables()
+            keys = numpy.repeat(numpy.arange(tables), counts)
+            picks = numpy.searchsorted(cum, keys + self.rng.random(len(keys)), side="right")
+            # Rounding can push a key onto the next table
+            picks = numpy.minimum(picks, offsets[keys + 1] - 1)
+            start = 0
+            for t in numpy.flatnonzero(counts).tolist():
+                end = start + int(counts[t])
+                draws[t] = rules[picks[start:end]].tolist() + draws[t]
+                start = end
+        self.reserved = [len(d) for d in draws]
+        self.reserved_inputs = n
+
+    def draw_tables(self):
+        if self.tables is None:
+            offsets = [0]
+            cum: List[float] = []
+            rules: List[int] = []
+            for t, (choices, weights) in enumerate(zip(self.choices, self.cum_weights)):
+                cum.extend(t + w / weights[-1] for w in weights)
+                rules.extend(choices)
+                offsets.append(len(cum))
+            self.tables = (numpy.array(offsets), numpy.array(cum), numpy.array(rules))
+        return self.tables
+
+    def fuzz(self) -> str:
+        return self.generate()[0]
+
+    def fuzz_tree(self) -> DerivationTree:
+        return self.generate(build_tree=True)[1]
+
+    def generate(self, build_tree: bool = False):
+        """Expand the start symbol. Returns the generated string and, with
+        `build_tree`, the derivation tree fuzzingbook would have built."""
+        while True:
+            try:
+                return self.expand(build_tree)
+            except RestartExpansionException:
+                pass
+
+    def enable_profiling(self) -> Profile:
+        """Start recording a Profile. As with MyFuzzer, the profiled expand
+        is installed on the instance, so the plain loop pays nothing."""
+        profile = self.profile = Profile()
+
+        def timed_pre(symbol: str, pre: Any) -> Any:
+            # Called for every rule, so that it also counts the expansions
+            # of rules without a pre function. Returning None changes
+            # nothing, as for a pre function that returns None.
+            def run() -> Any:
+                profile.expansions[symbol] += 1
+                if pre is None:
+                    return None
+                start = perf_counter_ns()
+                try:
+                    return pre()
+                finally:
+                    profile.pre_time[symbol] += perf_counter_ns() - start
+
+            return run
+
+        def timed_post(symbol: str, post: Any) -> Any:
+            def run(*args: str) -> Any:
+                start = perf_counter_ns()
+                try:
+                    return post(*args)
+                finally:
+                    profile.post_time[symbol] += perf_counter_ns() - start
+
+            return run
+
+        symbols = [self.symbols[symbol] for symbol in self.rule_symbols]
+        self.profiled_pre = [
+            timed_pre(symbol, pre) for symbol, pre in zip(symbols, self.rule_pre)
+        ]
+        self.profiled_post = [
+            None if post is None else timed_post(symbol, post)
+            for symbol, post in zip(symbols, self.rule_post)
+        ]
+        self.expand = self.profiled_expand
+        return profile
+
+    def disable_profiling(self) -> Optional[Profile]:
+        self.__dict__.pop("expand", None)
+        profile, self.profile = self.profile, None
+        return profile
+
+    def profiled_expand(self, build_tree: bool):
+        # The plain loop, on the timed pre and post functions
+        rule_pre, rule_post = self.rule_pre, self.rule_post
+        self.rule_pre, self.rule_post = self.profiled_pre, self.profiled_post
+        start = perf_counter_ns()
+        try:
+            return CompiledGenerator.expand(self, build_tree)
+        finally:
+            self.profile.generate_time += perf_counter_ns() - start
+            self.profile.inputs += 1
+            self.rule_pre, self.rule_post = rule_pre, rule_post
+
+    def expand(self, build_tree: bool):
+        choices = self.choices
+        cum_weights = self.cum_weights
+        draws = self.draws
+        min_cost = len(self.symbols)
+        rule_symbols = self.rule_symbols
+        rule_tokens = self.rule_tokens
+        rule_slots = self.rule_slots
+        rule_ordered = self.rule_ordered
+        rule_args = self.rule_args
+        rule_pre = self.rule_pre
+        rule_post = self.rule_post
+        uncovered = self.uncovered
+        covered = None if self.coverage is None else self.coverage.covered
+        symbols = self.symbols
+        max_nonterminals = self.max_nonterminals
+        rand = random.random
+
+        random_phase = True
+        open_nonterminals = 1
+        attempts = self.replacement_attempts
+
+        # A frame is [rule, buffer, incomplete slots, children in progress,
+        # tree nodes, parent, parent slot]. The root frame only holds the
+        # start symbol.
+        root = [None, [self.start], [0], {}, [None], None, 0]
+        while root[2]:
+            # Like fuzzingbook, every step walks down from the root, picking
+            # the lowest ordered or else a random incomplete child.
+            frame = root
+            while True:
+                incomplete = frame[2]
+                if len(incomplete) == 1 or rule_ordered[frame[0]]:
+                    slot = incomplete[0]
+                else:
+                    slot = incomplete[int(rand() * len(incomplete))]
+                child = frame[3].get(slot)
+                if child is None:
+                    break
+                frame = child
+
+            buffer = frame[1]
+            symbol = buffer[slot]
+            if random_phase and open_nonterminals >= max_nonterminals:
+                random_phase = False
+            open_nonterminals -= 1
+
+            table = symbol if random_phase else symbol + min_cost
+            rules = choices[table]
+            rule = self.pop_uncovered(table) if uncovered[table] else None
+            if rule is None:
+                if len(rules) == 1:
+                    rule = rules[0]
+                elif draws[table]:
+                    rule = draws[table].pop()
+                else:
+                    self.misses[table] += 1
+                    weights = cum_weights[table]
+                    rule = rules[bisect(weights, rand() * weights[-1])]
+            if covered is not None:
+                covered[rule] = 1
+
+            tokens = rule_tokens[rule]
+            child_slots = rule_slots[rule]
+            nodes = None
+            pre = rule_pre[rule]
+            if pre is not None:
+                result = pre()
+                if isinstance(result, list):
+                    tokens, child_slots = self.apply_list(rule, result)
+                elif result is not None and not isinstance(result, bool):
+                    if not isinstance(result, str):
+                        result = repr(result)
+                    tokens = [result]
+                    child_slots = []
+                    if build_tree:
+                        nodes = [(result, [])]
+
+            if build_tree and nodes is None:
+                nodes = [
+                    None if isinstance(token, int) else (token, [])
+                    for token in tokens
+                ]
+                if tokens is not rule_tokens[rule]:
+                    for i in rule_args[rule]:
+                        if nodes[i] is not None:
+                            nodes[i] = (symbols[rule_tokens[rule][i]], [nodes[i]])
+
+            if child_slots:
+                open_nonterminals += len(child_slots)
+                frame[3][slot] = [rule, list(tokens), list(child_slots), {}, nodes, frame, slot]
+                continue
+
+            # Completed in its own step: fuzzingbook runs no post function
+            # here.
+            buffer[slot] = "".join(tokens)
+            if build_tree:
+                frame[4][slot] = (symbols[symbol], nodes)
+            frame[2].remove(slot)
+
+            # Complete the frames up the path that are now done
+            while not frame[2] and frame is not root:
+                rule, buffer, _, _, nodes, parent, slot = frame
+                text = "".join(buffer)
+                if build_tree:
+                    tree = (symbols[rule_symbols[rule]], nodes)
+
+                post = rule_post[rule]
+                if post is not None:
+                    result = post(*[buffer[i] for i in rule_args[rule]])
+                    if isinstance(result, bool) and not result:
+                        if attempts <= 0:
+                            raise RestartExpansionException
+                        # Try another expansion of this symbol
+                        attempts -= 1
+                        open_nonterminals += 1
+                        del parent[3][slot]
+                        break
+                    if isinstance(result, list):
+                        # The replaced nonterminals keep their node
+                        for i, value in zip(rule_args[rule], result):
+                            if value is not None:
+                                buffer[i] = value if isinstance(value, str) else repr(value)
+                                if build_tree:
+                                    nodes[i] = (nodes[i][0], [(buffer[i], [])])
+                        text = "".join(buffer)
+                    elif result is not None and not isinstance(result, bool):
+                        text = result if isinstance(result, str) else repr(result)
+                        if build_tree:
+                            tree = (tree[0], [(text, [])])
+
+                parent[1][slot] = text
+                if build_tree:
+                    parent[4][slot] = tree
+                del parent[3][slot]
+                parent[2].remove(slot)
+                frame = parent
+
+        return root[1][0], root[4][0]
+
+    def apply_list(self, rule: int, result: List[Any]):
+        """Pre function results given per nonterminal fix those nonterminals'
+        text; they are not expanded further."""
+        tokens = list(self.rule_tokens[rule])
+        for i, value in zip(self.rule_args[rule], result):
+            if value is not None:
+                tokens[i] = value if isinstance(value, str) else repr(value)
+        slots = [i for i in self.rule_slots[rule] if isinstance(tokens[i], int)]
+        return tokens, slots
+
+
+# Statements that do not change the schema model in grammar.store, so that
+# parts of them can be replaced without replaying any schema side effects.
+MUTABLE_STATEMENTS = {
+    "<select-stmt>",
+    "<insert-stmt>",
+    "<analyze-stmt>",
+    "<pragma-stmt>",
+}
+# Nodes whose text names tables or indexes of the schema. They are never
+# replaced on their own, as the rest of the statement refers to the tables
+# they chose, and subtrees that contain them are never spliced.
+TABLE_SYMBOLS = {"<table-name>", "<table-or-subquery>", "<index-name>"}
+# Nodes whose text names columns of the statement's tables. Subtrees that
+# contain them are not spliced into other statements either.
+COLUMN_SYMBOLS = {"<column-name>", "<values-rows>", "<counter-rows>"}
+
+
+def contains_symbols(tree: DerivationTree, symbols: Set[str]) -> bool:
+    symbol, children = tree
+    if symbol in symbols:
+        return True
+    return any(contains_symbols(child, symbols) for child in children or [])
+
+
+def find_texts(tree: DerivationTree, symbol: str) -> List[str]:
+    if tree[0] == symbol:
+        return [all_terminals(tree)]
+    return [text for child in tree[1] or [] for text in find_texts(child, symbol)]
+
+
+class TreeMutator:
+    """Mutates the derivation trees of corpus seeds.
+
+    A mutation picks a nonterminal node of a seed's statement and either
+    regenerates it with `MyFuzzer.expand_tree`, or splices in a subtree of
+    the same symbol from another seed. The regenerated subtree runs its
+    pre/post functions inside the query processor of the statement, so new
+    column names come from the statement's table. Spliced subtrees never
+    contain schema names. Statements with schema side effects (CREATE,
+    ALTER, ...) and seeds that refer to tables which no longer exist are
+    re-derived from their statement expansion instead."""
+
+    def __init__(self, max_splice_subtrees: int = 64) -> None:
+        self.max_splice_subtrees = max_splice_subtrees
+        # symbol -> subtrees without schema names, from mutable seeds
+        self.subtrees: Dict[str, List[DerivationTree]] = {}
+
+    def add(self, seed: "Seed") -> None:
+        statement = seed.tree[1][0][1][0]
+        if statement[0] not in MUTABLE_STATEMENTS:
+            return
+        for _, node in self.nodes(statement):
+            if contains_symbols(node, TABLE_SYMBOLS | COLUMN_SYMBOLS):
+                continue
+            subtrees = self.subtrees.setdefault(node[0], [])
+            if len(subtrees) < self.max_splice_subtrees:
+                subtrees.append(node)
+            else:
+                subtrees[random.randrange(len(subtrees))] = node
+
+    def nodes(self, tree: DerivationTree, path=()) -> List[Any]:
+        """All expanded nonterminal nodes below `tree` that do not name
+        tables, with their paths of child indexes."""
+        result = []
+        for i, child in enumerate(tree[1] or []):
+            if not child[1] or child[0] in TABLE_SYMBOLS:
+                continue
+            result.append((path + (i,), child))
+            result.extend(self.nodes(child, path + (i,)))
+        return result
+
+    def is_valid(self, statement: DerivationTree) -> bool:
+        # Every table, and every column of these tables, that the statement
+        # names must still exist in the schema model.
+        tables = find_texts(statement, "<table-name>")
+        if not all(table in store.store for table in tables):
+            return False
+        return all(
+            any(store.has_column(table, column) for table in tables)
+            for column in find_texts(statement, "<column-name>")
+        )
+
+    def replace(
+        self, tree: DerivationTree, path, subtree: DerivationTree
+    ) -> DerivationTree:
+        if not path:
+            return subtree
+        symbol, children = tree
+        children = list(children)
+        children[path[0]] = self.replace(children[path[0]], path[1:], subtree)
+        return (symbol, children)
+
+    def mutate(self, fuzzer: MyFuzzer, seed: "Seed") -> DerivationTree:
+        phase_tree = seed.tree[1][0]
+        statement = phase_tree[1][0]
+        nodes = self.nodes(statement)
+        if (
+            statement[0] not in MUTABLE_STATEMENTS
+            or not nodes
+            or not self.is_valid(statement)
+        ):
+            return self.rederive(fuzzer, seed)
+
+        path, node = random.choice(nodes)
+        donors = [s for s in self.subtrees.get(node[0], []) if s is not node]
+        if donors and random.random() < 0.5:
+            subtree = random.choice(donors)
+        else:
+            subtree = self.regenerate(fuzzer, phase_tree, statement, node[0])
+        return self.replace(seed.tree, (0, 0) + path, subtree)
+
+    def regenerate(
+        self,
+        fuzzer: MyFuzzer,
+        phase_tree: DerivationTree,
+        statement: DerivationTree,
+        symbol: str,
+    ) -> DerivationTree:
+        # Run the pre/post functions of the phase expansion around the
+        # expansion, so that the subtree sees the statement's query processor.
+        expansion = fuzzer.find_expansion(phase_tree)
+        pre = exp_pre_expansion_function(expansion)
+        post = exp_post_expansion_function(expansion)
+        if pre is not None:
+            pre()
+        try:
+            tables = find_texts(statement, "<table-name>")
+            query_processor = store.query_processors[-1] if pre else None
+            if tables and query_processor is not None:
+                query_processor.qp.table_name = tables[0]
+            return fuzzer.expand_tree((symbol, None))
+        finally:
+            if post is not None:
+                post(all_terminals(statement))
+
+    def rederive(self, fuzzer: MyFuzzer, seed: "Seed") -> DerivationTree:
+        # Derive a new statement of the same kind as the seed: same phase,
+        # same statement expansion, fresh everything below.
+        phase_tree = seed.tree[1][0]
+        expansion = fuzzer.find_expansion(phase_tree)
+        return ("<start>", [fuzzer.derive(phase_tree[0], expansion)])
+
+
+class Seed:
+    def __init__(self, tree: DerivationTree, new_edges: int) -> None:
+        self.tree = tree
+        self.new_edges = new_edges
+        # How often the seed was mutated, and how many new edges its
+        # mutations found.
+        self.fuzz_count = 0
+        self.found = 0
+
+
+class PowerSchedule:
+    """Decides between fresh generation and mutation of corpus seeds, and
+    how much energy each seed gets, from the new edges that earlier inputs
+    found.
+
+    The gains of both actions and of the three phases are tracked as
+    exponential moving averages of new edges per input."""
+
+    def __init__(self, decay: float = 0.05, min_share: float = 0.1) -> None:
+        self.decay = decay
+        self.min_share = min_share
+        self.action_gain = {"generate": 1.0, "mutate": 1.0}
+        self.phase_gain = {phase: 1.0 for phase in PHASES}
+
+    def update(self, action: str, phase: str, new_edges: int) -> None:
+        for gains, key in [(self.action_gain, action), (self.phase_gain, phase)]:
+            gains[key] += self.decay * (new_edges - gains[key])
+
+    def shares(self, gains: List[float]) -> List[float]:
+        # Proportional to the gains, but never below min_share, so that no
+        # action or phase starves.
+        total = sum(gains)
+        if total <= 0:
+            return [1 / len(gains)] * len(gains)
+        shares = [max(gain / total, self.min_share) for gain in gains]
+        return [share / sum(shares) for share in shares]
+
+    def choose_action(self, corpus_size: int) -> str:
+        if corpus_size == 0:
+            return "generate"
+        generate, mutate = self.shares(
+            [self.action_gain["generate"], self.action_gain["mutate"]]
+        )
+        return "mutate" if random.random() < mutate else "generate"
+
+    def phase_weights(self) -> List[Optional[float]]:
+        # Whole percents for phases 1 and 2, the rest for phase 3, so that
+        # only a bounded number of phase configurations come up.
+        shares = self.shares(list(self.phase_gain.values()))
+        return [int(share * 100) / 100 for share in shares[:-1]] + [None]
+
+    def energy(self, seed: Seed) -> float:
+        # Seeds that found many edges, or whose mutations did, get more
+        # energy; it decays the more often a seed has been mutated.
+        return (1 + seed.new_edges + seed.found) / (1 + seed.fuzz_count)
+
+
+class Corpus:
+    """Derivation trees of the inputs that hit new edges."""
+
+    def __init__(self, schedule: PowerSchedule, max_size: int = 10_000) -> None:
+        self.schedule = schedule
+        self.max_size = max_size
+        self.seeds: List[Seed] = []
+
+    def __len__(self) -> int:
+        return len(self.seeds)
+
+    def add(self, seed: Seed) -> None:
+        if len(self.seeds) >= self.max_size:
+            # Replace the seed with the least energy left.
+            weakest = min(
+                range(len(self.seeds)),
+                key=lambda i: self.schedule.energy(self.seeds[i]),
+            )
+            self.seeds[weakest] = seed
+        else:
+            self.seeds.append(seed)
+
+    def choose(self) -> Seed:
+        energies = [self.schedule.energy(seed) for seed in self.seeds]
+        seed = random.choices(self.seeds, weights=energies)[0]
+        seed.fuzz_count += 1
+        return seed
+
+
+def normalize_token(match: "re.Match[str]") -> str:
+    token = match.group()
+    if token[0] == "'":
+        return "''"
+    if token[0].isdigit():
+        # Numbers of different lengths, e.g. 0 and 9223372036854775807,
+        # stay apart
+        return "#%d" % len(token)
+    if token.islower() or token.isupper():
+        # Keywords, and the names of pragmas, functions and collations
+        return token
+    return "x"
+
+
+class InputDedup:
+    """Remembers the normalized forms of the last `size` statements, so that
+    near-duplicates can be dropped before they are run. Normalization
+    replaces string literals, numbers by their length, and the random
+    mixed-case names of tables, columns and indices."""
+
+    def __init__(self, size: int = 65536) -> None:
+        self.size = size
+        self.seen: Dict[int, None] = {}
+        self.duplicates = 0
+
+    @staticmethod
+    def normalize(sqlcmd: str) -> str:
+        return SQL_TOKEN.sub(normalize_token, sqlcmd)
+
+    def add(self, sqlcmd: str) -> bool:
+        """Return False if `sqlcmd` is a near-duplicate of a recent
+        statement. Statements outside DEDUP_KEYWORDS are always new."""
+        keyword = sqlcmd.split(None, 1)[0].upper() if sqlcmd else ""
+        if keyword not in DEDUP_KEYWORDS:
+            return True
+        key = hash(self.normalize(sqlcmd))
+        if key in self.seen:
+            # Least recently seen first
+            del self.seen[key]
+            self.seen[key] = None
+            self.duplicates += 1
+            return False
+        self.seen[key] = None
+        if len(self.seen) > self.size:
+            del self.seen[next(iter(self.seen))]
+        return True
+
 
 class Fuzzer:
     def __init__(self):
@@ -188,45 +1211,176 @@ class Fuzzer:
 
     def setup_fuzzer(self):
         # This function may be changed.
-        self.grammar["<start>"] = [
-            ("<phase-1>", opts(prob=1.0)),
-            "<phase-2>",
-            "<phase-3>",
-        ]
+        # <start> expansions per phase weights, see set_phase_weights
+        self.phase_expansions: Dict[Tuple[Optional[float], ...], List[Expansion]] = {}
+        self.grammar["<start>"] = self.get_phase_expansions([1.0, None, None])
+        # The probabilities do not change what trim_grammar() keeps, so one
+        # trimmed grammar serves every phase configuration.
+        trimmed = trim_grammar(self.grammar)
+        self.coverage = ExpansionCoverage(trimmed)
         self.fuzzer = MyFuzzer(
-            trim_grammar(self.grammar),
+            trimmed,
+            coverage=self.coverage,
             # compute_costs=True
         )
+        self.generator = CompiledGenerator(
+            self.fuzzer.grammar, self.fuzzer._expansion_costs, coverage=self.coverage
+        )
+        self.schedule = PowerSchedule()
+        self.corpus = Corpus(self.schedule)
+        self.mutator = TreeMutator()
+        # Inputs handed out but not reported yet: input -> (tree, action, seed)
+        self.pending: Dict[str, Any] = {}
+        self.feedback = False
+
+    def report(self, sqlcmd: str, new_edges: int) -> None:
+        """Feedback from the executor: `sqlcmd` hit `new_edges` edges for the
+        first time. Once inputs are reported, the phase weights adapt to the
+        gains and inputs with new edges are kept in the corpus."""
+        if sqlcmd not in self.pending:
+            return
+        self.feedback = True
+        tree, action, seed = self.pending.pop(sqlcmd)
+        phase = tree[1][0][0]
+        self.schedule.update(action, phase, new_edges)
+        if seed is not None:
+            seed.found += new_edges
+        if new_edges > 0:
+            seed = Seed(tree, new_edges)
+            self.corpus.add(seed)
+            self.mutator.add(seed)
+
+    def get_state(self) -> Dict[str, Any]:
+        """What a resumed campaign needs from the fuzzer, for pickling: the
+        position in the phases, the schedule and the corpus. Inputs that
+        were not reported yet are left out."""
+        return {
+            "fuzz_count": self.fuzz_count,
+            "feedback": self.feedback,
+            "schedule": self.schedule,
+            "seeds": self.corpus.seeds,
+            "covered": bytes(self.coverage.covered),
+        }
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        self.fuzz_count = state["fuzz_count"]
+        self.feedback = state["feedback"]
+        self.schedule = state["schedule"]
+        self.corpus = Corpus(self.schedule)
+        self.mutator = TreeMutator()
+        self.pending.clear()
+        self.coverage.covered[:] = state["covered"]
+        for seed in state["seeds"]:
+            self.corpus.add(seed)
+            self.mutator.add(seed)
+        self.reset_phase_weights()
+
+    def reset_phase_weights(self) -> None:
+        """Set the phase weights that fuzz_one_input uses at this fuzz_count."""
+        if self.fuzz_count >= 100:
+            self.set_phase_weights(
+                self.schedule.phase_weights() if self.feedback else [0.05, 0.05, None]
+            )
+        elif self.fuzz_count >= 50:
+            self.set_phase_weights([0.0, 1.0, 0.0])
+        else:
+            self.set_phase_weights([1.0, None, None])
+
+    def get_phase_expansions(
+        self, weights: Sequence[Optional[float]]
+    ) -> List[Expansion]:
+        key = tuple(weights)
+        if key not in self.phase_expansions:
+            self.phase_expansions[key] = [
+                phase if weight is None else (phase, opts(prob=weight))
+                for phase, weight in zip(PHASES, weights)
+            ]
+        return self.phase_expansions[key]
+
+    def set_phase_weights(self, weights: Sequence[Optional[float]]) -> None:
+        """Switch the probabilities of the phases in place. A weight of None
+        gets an equal share of what the others leave. The expansions and
+        the probability tables are memoized per configuration."""
+        expansions = self.get_phase_expansions(weights)
+        self.grammar["<start>"] = expansions
+        self.fuzzer.set_expansions("<start>", expansions)
+        self.generator.set_probabilities("<start>", expansions)
+
+    def fuzz_batch(
+        self, n: int, each: Optional[Callable[[str], str]] = None
+    ) -> List[str]:
+        """Return `n` inputs, as `n` calls of fuzz_one_input would. The
+        expansion choices for the batch are drawn up front, in one NumPy call
+        if NumPy is installed. `each` maps every input right after it is
+        generated, before the next one, e.g. to regenerate duplicates."""
+        self.generator.reserve(n)
+        if each is None:
+            return [self.fuzz_one_input() for _ in range(n)]
+        return [each(self.fuzz_one_input()) for _ in range(n)]
+
+    def fuzz_session(self, k: int) -> List[str]:
+        """Return a script of `k` statements for an empty database. The
+        session runs through the phases on its own: tables first, then
+        indices and views, then the mixed workload. The schema model is
+        cleared first, so this does not mix with fuzz_one_input. The
+        statements are reported like inputs of fuzz_one_input, and its phase
+        weights apply again afterwards."""
+        store.clear()
+        create = max(1, int(k * SESSION_PHASE_SHARES[0]))
+        index = int(k * SESSION_PHASE_SHARES[1])
+        self.generator.reserve(k)
+        script = []
+        for weights, count in [
+            ([1.0, 0.0, 0.0], create),
+            ([0.0, 1.0, 0.0], index),
+            ([0.05, 0.05, None], k - create - index),
+        ]:
+            self.set_phase_weights(weights)
+            for _ in range(count):
+                self.fuzz_count += 1
+                script.append(self.generate_input())
+        self.reset_phase_weights()
+        return script
 
     def fuzz_one_input(self) -> str:
         # This function should be implemented, but the signature may not change.
         if self.fuzz_count == 50:
-            self.grammar["<start>"] = [
-                ("<phase-1>", opts(prob=0.0)),
-                ("<phase-2>", opts(prob=1.0)),
-                ("<phase-3>", opts(prob=0.0)),
-            ]
-            self.fuzzer = MyFuzzer(
-                trim_grammar(self.grammar),
-                precompute_costs=False,
-                symbol_costs=self.fuzzer._symbol_costs,
-                expansion_costs=self.fuzzer._expansion_costs,
-            )
+            self.set_phase_weights([0.0, 1.0, 0.0])
         if self.fuzz_count == 100:
-            self.grammar["<start>"] = [
-                ("<phase-1>", opts(prob=0.05)),
-                ("<phase-2>", opts(prob=0.05)),
-                "<phase-3>",
-            ]
-            self.fuzzer = MyFuzzer(
-                trim_grammar(self.grammar),
-                precompute_costs=False,
-                symbol_costs=self.fuzzer._symbol_costs,
-                expansion_costs=self.fuzzer._expansion_costs,
-            )
+            self.set_phase_weights([0.05, 0.05, None])
+
+        if (
+            self.feedback
+            and self.fuzz_count > 100
+            and self.fuzz_count % PHASE_UPDATE_INTERVAL == 0
+        ):
+            self.set_phase_weights(self.schedule.phase_weights())
 
         self.fuzz_count += 1
-        return self.fuzzer.fuzz()
+        action = "generate"
+        # Mutating before phase 3 would redo the phase 1/2 setup statements.
+        if self.fuzz_count > 100:
+            action = self.schedule.choose_action(len(self.corpus))
+        if action != "mutate":
+            return self.generate_input()
+        seed = self.corpus.choose()
+        return self.add_pending(self.mutator.mutate(self.fuzzer, seed), action, seed)
+
+    def generate_input(self) -> str:
+        if not self.feedback and self.fuzz_count > MAX_PENDING_INPUTS:
+            # Nothing has been reported back, so no tree is needed
+            return self.generator.fuzz()
+        return self.add_pending(self.generator.fuzz_tree(), "generate", None)
+
+    def add_pending(
+        self, tree: DerivationTree, action: str, seed: Optional[Seed]
+    ) -> str:
+        """Keep `tree` until its input is reported and return the input."""
+        sqlcmd = all_terminals(tree)
+        if len(self.pending) >= MAX_PENDING_INPUTS:
+            self.pending.pop(next(iter(self.pending)))
+        self.pending[sqlcmd] = (tree, action, seed)
+        return sqlcmd
 
 
 if __name__ == "__main__":
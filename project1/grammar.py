@@ -162,27 +162,203 @@ KEYWORDS = [
 ]
 
 
+KEYWORD_SET = frozenset(KEYWORDS)
+
+ALPHABET = string.ascii_letters
+# Maps random bytes to letters. The bytes past the last multiple of
+# len(ALPHABET) are deleted, so every letter is equally likely.
+LETTER_BYTES = len(ALPHABET) * (256 // len(ALPHABET))
+LETTER_TABLE = bytes(
+    ord(ALPHABET[b % len(ALPHABET)]) if b < LETTER_BYTES else 0 for b in range(256)
+)
+DISCARDED_BYTES = bytes(range(LETTER_BYTES, 256))
+
+# Name lengths for NamePool.set_lengths() when short names are wanted
+SHORT_NAME_LENGTHS = (4, 6)
+
+
+class NamePool:
+    """Random identifiers, drawn in bulk from `random.getrandbits`. Keywords
+    are filtered out while refilling."""
+
+    def __init__(self, min_length=10, max_length=15, size=1024):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.size = size
+        self.names = []
+
+    def set_lengths(self, min_length, max_length):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.names.clear()
+
+    def refill(self):
+        lengths = random.choices(
+            range(self.min_length, self.max_length + 1), k=self.size
+        )
+        needed = sum(lengths)
+        letters = ""
+        while len(letters) < needed:
+            # About a fifth of the bytes are discarded; draw a bit more.
+            count = (needed - len(letters)) * 5 // 4 + 8
+            raw = random.getrandbits(8 * count).to_bytes(count, "little")
+            letters += raw.translate(LETTER_TABLE, DISCARDED_BYTES).decode("ascii")
+
+        names = []
+        start = 0
+        for length in lengths:
+            name = letters[start : start + length]
+            start += length
+            if name.upper() not in KEYWORD_SET:
+                names.append(name)
+        self.names = names
+
+    def get(self):
+        if not self.names:
+            self.refill()
+        return self.names.pop()
+
+
+name_pool = NamePool()
+
+
 def get_random_string():
-    alpha = list(string.ascii_letters)
-    name_length = random.randint(10, 15)
-    result = "".join(
-        [alpha[random.randint(0, len(alpha) - 1)] for _ in range(name_length)]
-    )
-    return result
+    return name_pool.get()
 
 
 def get_random_name():
-    new_name = get_random_string()
-    while new_name.upper() in KEYWORDS:
-        new_name = get_random_string()
-    return new_name
+    # The pool never hands out keywords.
+    return name_pool.get()
+
+
+def typed_literal(column_type):
+    """A random value that a STRICT column of `column_type` accepts. Blobs
+    are large now and then, to reach overflow pages."""
+    if column_type == "INTEGER":
+        bits = random.choice((8, 32, 64))
+        return str(random.getrandbits(bits) - 2 ** (bits - 1))
+    if column_type == "REAL":
+        return repr(random.uniform(-1e9, 1e9))
+    if column_type == "TEXT":
+        return f"'{get_random_string()}'"
+    if column_type == "BLOB":
+        kind = random.randrange(3)
+        if kind == 0:
+            return f"x'{random.getrandbits(64):016x}'"
+        if kind == 1:
+            return f"randomblob({2 ** random.randint(0, 12)})"
+        return f"zeroblob({2 ** random.randint(0, 16)})"
+    return "NULL"
+
+
+# Values computed from the counter x of INSERT ... SELECT, per column type
+COUNTER_EXPRS = {
+    "INTEGER": ["x", "-x", "x * x", "random()", "abs(random()) % (x + 1)"],
+    "REAL": ["x * 0.5", "x / 7.0", "random() / 1e9"],
+    "TEXT": ["printf('%08d', x)", "hex(randomblob(8))", "'row' || x", "printf('%.*c', x % 500, 'x')"],
+    "BLOB": ["randomblob(x % 256 + 1)", "zeroblob(x % 1024)", "randomblob(16)"],
+}
+
+
+def counter_expr(column_type):
+    return random.choice(COUNTER_EXPRS.get(column_type, ["x"]))
+
+
+class IndexedSet:
+    """A set that also picks a uniformly random element in O(1). The
+    elements are kept in a list, with their positions in a dict."""
+
+    __slots__ = ("items", "positions")
+
+    def __init__(self, items=()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        # Move the last element into the gap.
+        position = self.positions.pop(item)
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def discard(self, item):
+        if item in self.positions:
+            self.remove(item)
+
+    def choice(self):
+        return random.choice(self.items)
+
+
+class TableRecord:
+    """One table of the schema model. The implicit "id" primary key is not
+    among the columns. `types` maps the columns whose declared type is
+    known to it. Most tables never get an index, so `indices` stays an
+    empty tuple until the first one."""
+
+    __slots__ = ("has_primary_key", "columns", "types", "indices")
+
+    def __init__(self, has_primary_key=True):
+        self.has_primary_key = has_primary_key
+        self.columns = IndexedSet()
+        self.types = {}
+        self.indices = ()
 
 
 class Store:
+    """The schema model: table name -> TableRecord. Tables, and tables with
+    indices, are indexed for random picks, so every change goes through the
+    methods below.
+
+    Inside a transaction every change also logs its inverse, so that a
+    savepoint is just a position in that log and ROLLBACK undoes back to it."""
+
     def __init__(self):
         self.store = {}
+        self.tables = IndexedSet()
+        self.indexed_tables = IndexedSet()
         self.schema = set()
         self.query_processors = []
+        # Processors that were popped, per class, for reuse
+        self.processor_pool = {}
+        # Undo log since the transaction began, and the open savepoints as
+        # (name, log position); BEGIN opens one named None.
+        self.journal = []
+        self.savepoints = []
+
+    def clear(self):
+        # Forget the whole schema, for a new database.
+        self.store = {}
+        self.tables = IndexedSet()
+        self.indexed_tables = IndexedSet()
+        self.schema = set()
+        self.journal = []
+        self.savepoints = []
+
+    def get_state(self):
+        # The schema model, for pickling. Open transactions are not part
+        # of it, the database does not keep them either.
+        return self.store, self.tables, self.indexed_tables, self.schema
+
+    def set_state(self, state):
+        self.clear()
+        self.store, self.tables, self.indexed_tables, self.schema = state
 
     def add_schema(self, schema_name):
         self.schema.add(schema_name)
@@ -195,25 +371,192 @@ class Store:
         return res
 
     def get_table_names(self):
-        return set(self.store.keys())
+        return self.tables
+
+    def get_random_table_name(self):
+        return self.tables.choice()
+
+    def record(self, undo, *args):
+        if self.savepoints:
+            self.journal.append((undo, args))
 
     def set_table(self, table_name, table_info):
+        previous = self.store.get(table_name)
+        if previous is None:
+            self.record(self.remove_table, table_name)
+        else:
+            self.record(self.set_table, table_name, previous)
         self.store[table_name] = table_info
+        self.tables.add(table_name)
+        if table_info.indices:
+            self.indexed_tables.add(table_name)
+        else:
+            self.indexed_tables.discard(table_name)
 
     def remove_table(self, table_name):
         assert table_name in self.store
-        self.store.pop(table_name)
+        self.record(self.set_table, table_name, self.store.pop(table_name))
+        self.tables.remove(table_name)
+        self.indexed_tables.discard(table_name)
+
+    def rename_table(self, table_name, new_table_name):
+        self.set_table(new_table_name, self.store[table_name])
+        self.remove_table(table_name)
 
     def get_table(self, table_name):
         return self.store[table_name]
 
+    def has_column(self, table_name, column_name):
+        return column_name == "id" or column_name in self.store[table_name].columns
+
+    def add_column(self, table_name, column_name, column_type=None):
+        table_info = self.store[table_name]
+        if column_name not in table_info.columns:
+            self.record(self.remove_column, table_name, column_name)
+            table_info.columns.add(column_name)
+            if column_type is not None:
+                table_info.types[column_name] = column_type
+
+    def remove_column(self, table_name, column_name):
+        table_info = self.store[table_name]
+        table_info.columns.remove(column_name)
+        column_type = table_info.types.pop(column_name, None)
+        self.record(self.add_column, table_name, column_name, column_type)
+
+    def get_column_type(self, table_name, column_name):
+        return self.store[table_name].types.get(column_name)
+
+    def set_column_type(self, table_name, column_name, column_type):
+        types = self.store[table_name].types
+        self.record(self.set_column_type, table_name, column_name, types.get(column_name))
+        if column_type is None:
+            types.pop(column_name, None)
+        else:
+            types[column_name] = column_type
+
+    def set_primary_key(self, table_name, has_primary_key):
+        table_info = self.store[table_name]
+        self.record(self.set_primary_key, table_name, table_info.has_primary_key)
+        table_info.has_primary_key = has_primary_key
+
+    def get_random_column_name(self, table_name):
+        return self.store[table_name].columns.choice()
+
+    def add_index(self, table_name, index_name):
+        table_info = self.store[table_name]
+        if not table_info.indices:
+            table_info.indices = IndexedSet()
+        if index_name not in table_info.indices:
+            self.record(self.remove_index, table_name, index_name)
+            table_info.indices.add(index_name)
+        self.indexed_tables.add(table_name)
+
+    def remove_index(self, table_name, index_name):
+        indices = self.store[table_name].indices
+        indices.remove(index_name)
+        self.record(self.add_index, table_name, index_name)
+        if not indices:
+            self.indexed_tables.discard(table_name)
+
+    def reconcile(self, tables):
+        """Make the model match the schema read from the database, given as
+        table name -> (column name -> type, has primary key, index names).
+        Temporary tables are not visible there and are kept. The database
+        is the authority from here on, so open savepoints are forgotten."""
+        self.commit()
+        for table_name in list(self.tables):
+            if table_name not in tables and not table_name.startswith("temp."):
+                self.remove_table(table_name)
+
+        for table_name, (columns, has_primary_key, indices) in tables.items():
+            if table_name not in self.store:
+                self.set_table(table_name, TableRecord(has_primary_key))
+            table_info = self.store[table_name]
+            if table_info.has_primary_key != has_primary_key:
+                self.set_primary_key(table_name, has_primary_key)
+            for column_name in list(table_info.columns):
+                if column_name not in columns:
+                    self.remove_column(table_name, column_name)
+            for column_name, column_type in columns.items():
+                if column_name == "id":
+                    continue
+                self.add_column(table_name, column_name)
+                if self.get_column_type(table_name, column_name) != column_type:
+                    self.set_column_type(table_name, column_name, column_type)
+            for index_name in list(table_info.indices):
+                if index_name not in indices:
+                    self.remove_index(table_name, index_name)
+            for index_name in indices:
+                self.add_index(table_name, index_name)
+
+    def get_random_index(self):
+        # Returns (table name, index name), or None without any index.
+        if not self.indexed_tables:
+            return None
+        table_name = self.indexed_tables.choice()
+        return table_name, self.store[table_name].indices.choice()
+
+    def undo(self, position):
+        entries = self.journal[position:]
+        for undo, args in reversed(entries):
+            undo(*args)
+        # The undo calls logged their own inverses; drop those as well.
+        del self.journal[position:]
+
+    def find_savepoint(self, name):
+        for i in range(len(self.savepoints) - 1, -1, -1):
+            if self.savepoints[i][0] == name:
+                return i
+        return None
+
+    def begin(self):
+        # BEGIN inside a transaction is an error and changes nothing.
+        if not self.savepoints:
+            self.savepoints.append((None, 0))
+
+    def savepoint(self, name):
+        self.savepoints.append((name, len(self.journal)))
+
+    def release(self, name):
+        i = self.find_savepoint(name)
+        if i is not None:
+            del self.savepoints[i:]
+            if not self.savepoints:
+                self.journal.clear()
+
+    def commit(self):
+        self.savepoints.clear()
+        self.journal.clear()
+
+    def rollback(self, name=None):
+        if name is None:
+            self.undo(0)
+            self.savepoints.clear()
+            return
+        # ROLLBACK TO keeps the savepoint itself open.
+        i = self.find_savepoint(name)
+        if i is not None:
+            self.undo(self.savepoints[i][1])
+            del self.savepoints[i + 1 :]
+
+    def get_savepoint_name(self):
+        names = [name for name, _ in self.savepoints if name is not None]
+        return random.choice(names) if names else None
+
     def append_query_processor(self, query_processor):
         # print(f"appending_query_processor: {query_processor}")
-        self.query_processors.append(query_processor(self))
+        pool = self.processor_pool.get(query_processor)
+        if pool:
+            processor = pool.pop()
+            processor.qp.table_name = None
+        else:
+            processor = query_processor(self)
+        self.query_processors.append(processor)
         return True
 
     def pop_query_processor(self):
-        self.query_processors.pop()
+        processor = self.query_processors.pop()
+        self.processor_pool.setdefault(type(processor), []).append(processor)
         return True
 
     def get_query_processor(self):
@@ -226,111 +569,115 @@ class QueryProcessor:
         self.store: Store = store
         self.table_name = None
 
+    @staticmethod
     def is_keyword(name: str):
-        return name.upper() in KEYWORDS
+        return name.upper() in KEYWORD_SET
 
     def get_new_table_name(self):
-        init_empty_table = lambda: {
-            "has_primary_key": True,
-            "columns": set(["id"]),
-            "indices": set(),
-        }
-
         table_names = self.store.get_table_names()
         new_name = get_random_string()
         while new_name in table_names:
             new_name = get_random_string()
 
-        self.store.set_table(new_name, init_empty_table())
+        self.store.set_table(new_name, TableRecord())
         self.table_name = new_name
 
         return new_name
 
     def get_new_column_name(self):
         assert self.table_name is not None
-        current_table = self.store.get_table(self.table_name)
-
         new_name = get_random_string()
 
-        while new_name in current_table["columns"]:
+        while self.store.has_column(self.table_name, new_name):
             new_name = get_random_string()
 
-        current_table["columns"].add(new_name)
-        self.store.set_table(self.table_name, current_table)
+        self.store.add_column(self.table_name, new_name)
 
         return new_name
 
     def get_table_name(self):
-        result = random.choice(list(self.store.get_table_names()))
+        result = self.store.get_random_table_name()
         self.table_name = result
         return self.table_name
 
     def get_column_name(self):
         assert self.table_name is not None
-        current_table = self.store.get_table(self.table_name)
-        return random.choice(list(current_table["columns"] - {"id"}))
+        return self.store.get_random_column_name(self.table_name)
 
     def update_table_name(self, table_name, new_table_name):
         # print(f"query_processor: update_table_name to {new_table_name}")
-        table_info = self.store.get_table(table_name)
-        self.store.set_table(new_table_name, table_info)
-        self.store.remove_table(table_name)
+        self.store.rename_table(table_name, new_table_name)
         self.table_name = new_table_name
         return True
 
     def update_column_name(self, column_name, new_column_name):
         assert self.table_name is not None
-        current_table = self.store.get_table(self.table_name)
-        current_table["columns"].add(new_column_name)
-        current_table["columns"].remove(column_name)
-        self.store.set_table(self.table_name, current_table)
+        column_type = self.store.get_column_type(self.table_name, column_name)
+        self.store.add_column(self.table_name, new_column_name, column_type)
+        self.store.remove_column(self.table_name, column_name)
+        return True
+
+    def set_column_type(self, column_name, column_type):
+        assert self.table_name is not None
+        self.store.set_column_type(self.table_name, column_name, column_type)
         return True
 
     def delete_column_name(self, table_name, column_name):
         # print(f"delete_column_name: {column_name}")
         assert self.table_name is not None
-        current_table = self.store.get_table(self.table_name)
-        # print("before:")
-        # pprint(current_table)
-        current_table["columns"].remove(column_name)
-        self.store.set_table(self.table_name, current_table)
-        # print("after:")
-        # pprint(self.store.get_table(self.table_name))
+        self.store.remove_column(self.table_name, column_name)
         return True
 
     def set_primary_key(self, columns):
         # print(f"set_primary_key table: {self.table_name}: {columns}")
         current_table = self.store.get_table(self.table_name)
-        if current_table["has_primary_key"]:
+        if current_table.has_primary_key:
             # print(f"set_primary_key table: {self.table_name} already has one...")
             return "CHECK(1)"
-        current_table["has_primary_key"] = True
-        self.store.set_table(self.table_name, current_table)
+        self.store.set_primary_key(self.table_name, True)
         return True
 
     def mark_table_temporary(self, table_name):
         self.update_table_name(table_name, f"temp.{table_name}")
         return True
 
+    def get_insert_columns(self):
+        columns = list(self.store.get_table(self.table_name).columns)
+        types = [self.store.get_column_type(self.table_name, c) for c in columns]
+        return columns, types
+
+    def get_values_rows(self):
+        # A multi-row VALUES list with a literal of the right type per column
+        columns, types = self.get_insert_columns()
+        if not columns:
+            return "DEFAULT VALUES"
+        rows = [
+            "(" + ", ".join(typed_literal(t) for t in types) + ")"
+            for _ in range(2 ** random.randint(0, 7))
+        ]
+        return f"({', '.join(columns)}) VALUES {', '.join(rows)}"
+
+    def get_counter_rows(self):
+        # One row per value x of the recursive counter `cnt`
+        columns, types = self.get_insert_columns()
+        if not columns:
+            return "DEFAULT VALUES"
+        values = ", ".join(counter_expr(t) for t in types)
+        return f"({', '.join(columns)}) SELECT {values} FROM cnt"
+
     def create_index(self, table_name, index_name):
         assert table_name == self.table_name
         # print(f"create_index: table_name: {table_name}, index_name: {index_name}")
-        current_table = self.store.get_table(table_name)
-        current_table["indices"].add(index_name)
-        self.store.set_table(table_name, current_table)
+        self.store.add_index(table_name, index_name)
         return True
 
     def get_index(self, table_name):
-        table_with_indices = dict(
-            filter(
-                lambda item: item[1]["indices"],
-                self.store.store.items(),
-            )
-        )
-        table_name = random.choice(list(table_with_indices.keys()))
-        # print(table_with_indices[table_name])
+        index = self.store.get_random_index()
+        if index is None:
+            # No index to name; keep the table without INDEXED BY.
+            return table_name
+        table_name, index_name = index
         self.table_name = table_name
-        index_name = random.choice(list(table_with_indices[table_name]["indices"]))
         return f"{table_name} INDEXED BY {index_name}"
 
     def add_schema(self, schema_name):
@@ -352,6 +699,12 @@ class InsertProcessor:
     def get_table_name(self):
         return self.qp.get_table_name()
 
+    def get_values_rows(self):
+        return self.qp.get_values_rows()
+
+    def get_counter_rows(self):
+        return self.qp.get_counter_rows()
+
 
 class AttachProcessor:
     def __init__(self, store: Store) -> None:
@@ -403,6 +756,9 @@ class CreateTableProcessor:
     def mark_table_temporary(self, table_name):
         return self.qp.mark_table_temporary(table_name)
 
+    def set_column_type(self, column_name, column_type):
+        return self.qp.set_column_type(column_name, column_type)
+
 
 class AnalyzeProcessor:
     def __init__(self, store: Store) -> None:
@@ -503,20 +859,54 @@ column_def = {
     "<column-def>": [
         (
             "<new-column-name> TEXT <column-constraint-base> DEFAULT ( <string-expr> )",
-            opts(order=(1, 2, 3)),
+            opts(
+                order=(1, 2, 3),
+                post=lambda column_name, _, __: store.get_query_processor().set_column_type(
+                    column_name, "TEXT"
+                ),
+            ),
         ),
         (
             "<new-column-name> INTEGER <column-constraint-base> DEFAULT ( <integer-expr> )",
-            opts(order=(1, 2, 3)),
+            opts(
+                order=(1, 2, 3),
+                post=lambda column_name, _, __: store.get_query_processor().set_column_type(
+                    column_name, "INTEGER"
+                ),
+            ),
         ),
         (
             "<new-column-name> REAL <column-constraint-base> DEFAULT ( <real-expr> )",
-            opts(order=(1, 2, 3)),
+            opts(
+                order=(1, 2, 3),
+                post=lambda column_name, _, __: store.get_query_processor().set_column_type(
+                    column_name, "REAL"
+                ),
+            ),
+        ),
+        (
+            "<new-column-name> BLOB <column-constraint-base> DEFAULT ( <blob-expr> )",
+            opts(
+                order=(1, 2, 3),
+                post=lambda column_name, _, __: store.get_query_processor().set_column_type(
+                    column_name, "BLOB"
+                ),
+            ),
         ),
     ],
 }
 
 
+blob_expr = {
+    "<blob-expr>": [
+        "x''",
+        "zeroblob(<digit><digit>)",
+        "randomblob(<digit>)",
+        "CAST(<string-literal> AS BLOB)",
+    ]
+}
+
+
 column_constraint = {
     "<column-constraint-base>": [
         "NOT NULL",
@@ -894,7 +1284,10 @@ misc = {
     "<name>": ["<characters>"],
     "<collation-name>": ["RTRIM", "NOCASE", "BINARY"],
     "<view-name>": ["<characters>"],
-    "<savepoint-name>": ["<characters>"],
+    "<savepoint-name>": [
+        ("<characters>", opts(pre=lambda: store.get_savepoint_name()))
+    ],
+    "<new-savepoint-name>": ["<characters>"],
     "<index-name>": ["<characters>"],
     "<new-index-name>": ["<characters>"],
 }
@@ -982,6 +1375,28 @@ rollback_stmt = {
     ]
 }
 
+savepoint_stmt = {
+    "<savepoint-stmt>": [
+        "SAVEPOINT <new-savepoint-name>",
+    ]
+}
+
+release_stmt = {
+    "<release-stmt>": [
+        "RELEASE <savepoint-name>",
+        "RELEASE SAVEPOINT <savepoint-name>",
+    ]
+}
+
+
+def savepoint_name(statement):
+    # The savepoint a ROLLBACK or RELEASE names, if any, ends the statement.
+    words = statement.split()
+    if words[0] == "ROLLBACK" and "TO" not in words:
+        return None
+    return words[-1]
+
+
 pragma_stmt = {
     "<pragma-stmt>": [
         "PRAGMA <pragma-name> = <integer>",
@@ -1100,7 +1515,32 @@ insert_stmt = {
     "<insert-stmt>": [
         "INSERT INTO <table-name> DEFAULT VALUES",
         "REPLACE INTO <table-name> DEFAULT VALUES",
-    ]
+        ("INSERT INTO <table-name> <values-rows>", opts(order=(1, 2))),
+        ("REPLACE INTO <table-name> <values-rows>", opts(order=(1, 2))),
+        ("INSERT OR IGNORE INTO <table-name> <values-rows>", opts(order=(1, 2))),
+        (
+            "WITH RECURSIVE <counter> INSERT INTO <table-name> <counter-rows>",
+            opts(order=(1, 2, 3)),
+        ),
+        (
+            "WITH RECURSIVE <counter> INSERT OR IGNORE INTO <table-name> <counter-rows>",
+            opts(order=(1, 2, 3)),
+        ),
+    ],
+    "<values-rows>": [
+        ("<characters>", opts(pre=lambda: store.get_query_processor().get_values_rows()))
+    ],
+    "<counter-rows>": [
+        ("<characters>", opts(pre=lambda: store.get_query_processor().get_counter_rows()))
+    ],
+    "<counter>": [
+        "cnt(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM cnt WHERE x < <row-count>)"
+    ],
+    "<row-count>": [
+        "<digit><digit>",
+        "<digit><digit><digit>",
+        ("<digit><digit><digit><digit>", opts(prob=0.1)),
+    ],
 }
 
 
@@ -1165,7 +1605,7 @@ real = {
 
 string_literal = {
     "<string-literal>": ["'<characters>'"],
-    "<characters>": [("<dummy>", opts(pre=get_random_string))],
+    "<characters>": [("<dummy>", opts(pre=name_pool.get))],
     "<character>": [
         ("<dummy>", opts(pre=lambda: random.choice(list(string.ascii_letters))))
     ],
@@ -1323,6 +1763,8 @@ stmt = {
         "<begin-stmt>",
         "<commit-stmt>",
         "<rollback-stmt>",
+        "<savepoint-stmt>",
+        "<release-stmt>",
         "<attach-stmt>",
         "<detach-stmt>",
     ]
@@ -1382,9 +1824,29 @@ grammar = {
         ("<drop-index-stmt>", opts(prob=0.01)),
         ("<drop-view-stmt>", opts(prob=0.01)),
         ("<vacuum-stmt>", opts(prob=0.001)),
-        ("<begin-stmt>", opts(prob=0.001)),
-        ("<commit-stmt>", opts(prob=0.001)),
-        ("<rollback-stmt>", opts(prob=0.001)),
+        ("<begin-stmt>", opts(prob=0.001, post=lambda _: store.begin())),
+        ("<commit-stmt>", opts(prob=0.001, post=lambda _: store.commit())),
+        (
+            "<rollback-stmt>",
+            opts(
+                prob=0.001,
+                post=lambda stmt: store.rollback(savepoint_name(stmt)),
+            ),
+        ),
+        (
+            "<savepoint-stmt>",
+            opts(
+                prob=0.001,
+                post=lambda stmt: store.savepoint(savepoint_name(stmt)),
+            ),
+        ),
+        (
+            "<release-stmt>",
+            opts(
+                prob=0.001,
+                post=lambda stmt: store.release(savepoint_name(stmt)),
+            ),
+        ),
         ("<attach-stmt>", opts(prob=0.001)),
         ("<detach-stmt>", opts(prob=0.001)),
         (
@@ -1400,6 +1862,7 @@ grammar = {
     **attach_stmt,
     **begin_stmt,
     **binary_operator,
+    **blob_expr,
     **bool_expr,
     **column_constraint,
     **column_def,
@@ -1429,7 +1892,9 @@ grammar = {
     **misc,
     **pragma_stmt,
     **result_column,
+    **release_stmt,
     **rollback_stmt,
+    **savepoint_stmt,
     **select_stmt,
     **string_literal,
     **table_constraint,
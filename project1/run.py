@@ -3,10 +3,27 @@ import random
 import csv
 import argparse
 import os
+import select
+import contextlib
+import shutil
+import glob
+import multiprocessing
+import struct
+import re
+import mmap
+import tempfile
+import atexit
+import sqlite3
+import ctypes
+import signal
+import pickle
+import time
+import threading
 
 import matplotlib.pyplot as plt
 
-from fuzzer import Fuzzer
+from fuzzer import Fuzzer, InputDedup
+from grammar import store, name_pool, SHORT_NAME_LENGTHS
 
 
 def plot(x, y):
@@ -18,17 +35,956 @@ def plot(x, y):
     print("Saved plot.pdf")
 
 
-class Experiment:
+SENTINEL = b"__fuzzer_end_of_result__"
+GCOV_JOBS_DIR = "gcov-jobs"
+CHECKPOINT_DIR = "checkpoint"
+TIME_SERIES_FILE = "coverage.csv"
+# A near-duplicate input is regenerated at most this many times.
+DEDUP_ATTEMPTS = 8
+PIPE_CHUNK = 1 << 16
+BARRIER_TIMEOUT = 60.0
+EDGE_MAP_SIZE = 1 << 16
+EDGE_MAP_ZERO = bytes(EDGE_MAP_SIZE)
+EDGE_MAP_HIT = bytes([0] + [1] * 255)
+
+
+class EdgeMap:
+    """The edge hit counters of one sqlite3-edges process (edge_coverage.c),
+    shared through a memory-mapped file in /dev/shm."""
+
+    def __init__(self):
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, self.path = tempfile.mkstemp(prefix="sqlite3-edges-", dir=directory)
+        os.ftruncate(fd, EDGE_MAP_SIZE)
+        self.map = mmap.mmap(fd, EDGE_MAP_SIZE)
+        os.close(fd)
+        atexit.register(self.close)
+
+    def get_env(self, env=None):
+        env = dict(os.environ if env is None else env)
+        env["SQLITE_EDGE_MAP"] = self.path
+        return env
+
+    def reset(self):
+        self.map[:] = EDGE_MAP_ZERO
+
+    def get_hits(self):
+        # One byte per edge, 1 if it was hit, packed into a single int.
+        return int.from_bytes(self.map[:].translate(EDGE_MAP_HIT), "little")
+
+    def close(self):
+        if not self.map.closed:
+            self.map.close()
+            os.unlink(self.path)
+
+
+class EdgeFeedback:
+    """Counts the edges that an input hit for the first time."""
+
     def __init__(self):
+        self.seen = 0
+        self.total = 0
+
+    def get_new_edges(self, edge_map):
+        hits = edge_map.get_hits()
+        new_edges = (hits & ~self.seen).bit_count()
+        self.seen |= hits
+        self.total += new_edges
+        return new_edges
+
+
+def encode_statements(sqlcmds):
+    # Every statement is followed by a `.print` of SENTINEL, so the output
+    # that belongs to one statement ends right before the sentinel line.
+    return b"".join(
+        sqlcmd.encode() + b"\n;\n.print " + SENTINEL + b"\n" for sqlcmd in sqlcmds
+    )
+
+
+def split_outputs(output, count):
+    outputs = output.split(SENTINEL + b"\n")[:count]
+    return outputs + [b""] * (count - len(outputs))
+
+
+class SQLiteWorker:
+    """A long-lived sqlite3 process that reads statements from its stdin.
+
+    A batch of statements is encoded at once, see encode_statements. stdin
+    is non-blocking and the batch is written while the results are read, so
+    a batch larger than the pipe buffers cannot block both processes.
+    """
+
+    def __init__(
+        self,
+        sqlite3,
+        db_file,
+        max_statements=1000,
+        timeout=10.0,
+        env=None,
+        edge_feedback=None,
+    ):
+        self.sqlite3 = sqlite3
+        self.db_file = db_file
+        self.max_statements = max_statements
+        self.timeout = timeout
+        self.env = env
+        self.edge_feedback = edge_feedback
+        self.edge_map = None
+        if edge_feedback is not None:
+            self.edge_map = EdgeMap()
+            self.env = self.edge_map.get_env(env)
+        self.process = None
+        self.pending = []
+        self.statements = 0
+        self.buffer = b""
+        self.unsent = b""
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.sqlite3, self.db_file],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=self.env,
+        )
+        os.set_blocking(self.process.stdin.fileno(), False)
+        self.statements = 0
+        self.buffer = b""
+        self.unsent = b""
+
+    def stop(self):
+        # sqlite3 only writes its .gcda counters on a normal exit, so close
+        # stdin and let it terminate instead of killing it.
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=self.timeout)
+        except (BrokenPipeError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+        self.pending = []
+        # A transaction that was still open ended with the process. The
+        # next input may already be generated, so the model cannot undo the
+        # transaction exactly; it only stops journaling.
+        store.commit()
+
+    def send(self, sqlcmd):
+        self.send_batch([sqlcmd])
+
+    def send_batch(self, sqlcmds):
+        assert not self.pending
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+        self.pending = list(sqlcmds)
+        self.statements += len(sqlcmds)
+        if self.edge_map is not None:
+            self.edge_map.reset()
+        self.unsent = encode_statements(sqlcmds)
+        self.write_unsent()
+
+    def write_unsent(self):
+        # Writes as much as the pipe takes; receive_batch writes the rest.
+        try:
+            written = os.write(self.process.stdin.fileno(), self.unsent[:PIPE_CHUNK])
+            self.unsent = self.unsent[written:]
+        except BlockingIOError:
+            pass
+        except BrokenPipeError:
+            self.unsent = b""
+
+    def receive(self):
+        """Wait for the result of the pending statement.
+
+        Returns the statement, its output and the number of new edges (None
+        without edge feedback). A worker that crashed, hung or reached
+        max_statements is stopped and restarted on the next send."""
+        assert len(self.pending) == 1
+        return self.receive_batch()[0]
+
+    def receive_batch(self):
+        """Wait for the results of all pending statements, see receive.
+
+        The edge map is shared by the whole batch, so only the last statement
+        gets its new edges. Statements after a crash get no output."""
+        assert self.pending
+        sqlcmds, self.pending = self.pending, []
+        fd = self.process.stdout.fileno()
+        alive = True
+        outputs = []
+        while alive and len(outputs) < len(sqlcmds):
+            while SENTINEL + b"\n" not in self.buffer:
+                writing = [self.process.stdin] if self.unsent else []
+                ready, writable, _ = select.select([fd], writing, [], self.timeout)
+                if writable:
+                    self.write_unsent()
+                    if not ready:
+                        continue
+                chunk = os.read(fd, 65536) if ready else b""
+                if not chunk:
+                    alive = False
+                    break
+                self.buffer += chunk
+
+            if alive:
+                output, self.buffer = self.buffer.split(SENTINEL + b"\n", 1)
+            else:
+                output, self.buffer = self.buffer, b""
+            outputs.append(output)
+        outputs += [b""] * (len(sqlcmds) - len(outputs))
+
+        new_edges = [None] * len(sqlcmds)
+        if self.edge_map is not None:
+            new_edges[-1] = self.edge_feedback.get_new_edges(self.edge_map)
+
+        if not alive:
+            self.process.kill()
+            self.stop()
+        elif self.statements >= self.max_statements:
+            self.stop()
+        return list(zip(sqlcmds, outputs, new_edges))
+
+
+SQLITE_OK = 0
+SQLITE_NOMEM = 7
+SQLITE_ROW = 100
+SQLITE_DONE = 101
+
+
+def load_library(library):
+    lib = ctypes.CDLL(os.path.abspath(library))
+    lib.sqlite3_open.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_void_p)]
+    lib.sqlite3_close_v2.argtypes = [ctypes.c_void_p]
+    lib.sqlite3_prepare_v2.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_void_p,
+        ctypes.c_int,
+        ctypes.POINTER(ctypes.c_void_p),
+        ctypes.POINTER(ctypes.c_void_p),
+    ]
+    lib.sqlite3_step.argtypes = [ctypes.c_void_p]
+    lib.sqlite3_finalize.argtypes = [ctypes.c_void_p]
+    lib.sqlite3_column_count.argtypes = [ctypes.c_void_p]
+    lib.sqlite3_column_text.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.sqlite3_column_text.restype = ctypes.c_char_p
+    lib.sqlite3_errmsg.argtypes = [ctypes.c_void_p]
+    lib.sqlite3_errmsg.restype = ctypes.c_char_p
+    return lib
+
+
+def execute_sql(lib, db, sqlcmd):
+    """Run every statement in `sqlcmd` and return the rows and errors as
+    the sqlite3 shell would print them, and whether SQLite ran out of
+    memory."""
+    sql = sqlcmd.encode()
+    buffer = ctypes.create_string_buffer(sql)
+    end = ctypes.addressof(buffer) + len(sql)
+    tail = ctypes.c_void_p(ctypes.addressof(buffer))
+    stmt = ctypes.c_void_p()
+    lines = []
+    rc = SQLITE_OK
+    while tail.value < end:
+        rc = lib.sqlite3_prepare_v2(
+            db, tail, end - tail.value, ctypes.byref(stmt), ctypes.byref(tail)
+        )
+        if rc != SQLITE_OK:
+            lines.append(b"Parse error: " + lib.sqlite3_errmsg(db))
+            break
+        if not stmt.value:
+            # Only whitespace or comments were left
+            continue
+        columns = range(lib.sqlite3_column_count(stmt))
+        rc = lib.sqlite3_step(stmt)
+        while rc == SQLITE_ROW:
+            lines.append(b"|".join(lib.sqlite3_column_text(stmt, i) or b"" for i in columns))
+            rc = lib.sqlite3_step(stmt)
+        if rc != SQLITE_DONE:
+            lines.append(b"Runtime error: " + lib.sqlite3_errmsg(db))
+        lib.sqlite3_finalize(stmt)
+        if rc == SQLITE_NOMEM:
+            break
+    output = b"".join(line + b"\n" for line in lines)
+    return output, rc == SQLITE_NOMEM
+
+
+def run_library(library, db_file, connection, env):
+    # The forked child of a LibraryWorker. The library is only loaded here,
+    # so its coverage counters start at zero in every child.
+    if env is not None:
+        os.environ.update(env)
+    lib = load_library(library)
+    db = ctypes.c_void_p()
+    if lib.sqlite3_open(db_file.encode(), ctypes.byref(db)) != SQLITE_OK:
+        # Sent in place of the first results, see LibraryWorker.receive_batch.
+        message = lib.sqlite3_errmsg(db).decode(errors="replace")
+        connection.send(RuntimeError(f"cannot open {db_file}: {message}"))
+        lib.sqlite3_close_v2(db)
+        ctypes.CDLL(None).exit(1)
+    while True:
+        sqlcmds = connection.recv()
+        if sqlcmds is None:
+            break
+        # Like the sqlite3 shell, give up on the first out-of-memory error
+        # (PRAGMA hard_heap_limit makes them common). The worker restarts.
+        outputs = []
+        for sqlcmd in sqlcmds:
+            output, out_of_memory = execute_sql(lib, db, sqlcmd)
+            outputs.append(output)
+            if out_of_memory:
+                break
+        connection.send((outputs, out_of_memory))
+        if out_of_memory:
+            break
+    lib.sqlite3_close_v2(db)
+    # The .gcda counters are written by an exit handler of the library,
+    # which os._exit at the end of a multiprocessing child would skip.
+    ctypes.CDLL(None).exit(0)
+
+
+class LibraryWorker:
+    """Runs statements through the instrumented libsqlite3.so, loaded with
+    ctypes in a forked child. The child is watched like a sqlite3 process of
+    SQLiteWorker: a crash or a hang only costs the child, which is
+    restarted on the next send. Same interface as SQLiteWorker."""
+
+    def __init__(
+        self,
+        library,
+        db_file,
+        max_statements=1000,
+        timeout=10.0,
+        env=None,
+        edge_feedback=None,
+    ):
+        assert edge_feedback is None, "the library has no edge map"
+        self.edge_map = None
+        self.library = library
+        self.db_file = db_file
+        self.max_statements = max_statements
+        self.timeout = timeout
+        self.env = env
+        self.process = None
+        self.connection = None
+        self.pending = []
+        self.statements = 0
+
+    def start(self):
+        context = multiprocessing.get_context("fork")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=run_library,
+            args=(self.library, self.db_file, child_connection, self.env),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.statements = 0
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(self.timeout)
+        if self.process.exitcode is None:
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+        self.process = None
+        self.pending = []
+        store.commit()
+
+    def send(self, sqlcmd):
+        self.send_batch([sqlcmd])
+
+    def send_batch(self, sqlcmds):
+        assert not self.pending
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            self.start()
+        self.pending = list(sqlcmds)
+        self.statements += len(sqlcmds)
+        try:
+            self.connection.send(self.pending)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def receive(self):
+        assert len(self.pending) == 1
+        return self.receive_batch()[0]
+
+    def receive_batch(self):
+        """Wait for the results of all pending statements. After a crash or
+        a hang, every statement of the batch gets no output. Raises
+        RuntimeError if the child could not open the database."""
+        assert self.pending
+        sqlcmds, self.pending = self.pending, []
+        result = None
+        try:
+            if self.connection.poll(self.timeout):
+                result = self.connection.recv()
+        except (EOFError, OSError):
+            pass
+
+        if isinstance(result, Exception):
+            self.stop()
+            raise result
+        outputs, exiting = result or (None, False)
+        if outputs is None:
+            self.process.kill()
+            self.stop()
+            outputs = []
+        elif exiting or self.statements >= self.max_statements:
+            self.stop()
+        outputs += [b""] * (len(sqlcmds) - len(outputs))
+        return [(sqlcmd, output, None) for sqlcmd, output in zip(sqlcmds, outputs)]
+
+
+class ForkServer:
+    """sqlite3 started once under the forkserver.so shim (forkserver.c),
+    which forks a fresh child from the initialized process for every test
+    case. A test case is a whole script; the child reads it from a file and
+    writes its output to another one, both in /dev/shm if possible."""
+
+    def __init__(self, sqlite3, db_file, timeout=10.0, env=None):
+        self.sqlite3 = sqlite3
+        self.db_file = db_file
+        self.timeout = timeout
+        self.env = dict(os.environ if env is None else env)
+        self.shim = os.path.join(os.path.dirname(os.path.abspath(sqlite3)), "forkserver.so")
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        self.directory = tempfile.mkdtemp(prefix="sqlite3-forkserver-", dir=directory)
+        self.input_file = os.path.join(self.directory, "input.sql")
+        self.output_file = os.path.join(self.directory, "output.txt")
+        self.process = None
+        self.ctl = None
+        self.status = None
+        atexit.register(self.close)
+
+    def start(self):
+        if not os.path.exists(self.shim):
+            raise FileNotFoundError("forkserver.so not found. Run make forkserver.so first.")
+        ctl_read, self.ctl = os.pipe()
+        self.status, status_write = os.pipe()
+        env = dict(self.env)
+        env["LD_PRELOAD"] = self.shim
+        env["FORKSERVER_CTL_FD"] = str(ctl_read)
+        env["FORKSERVER_STATUS_FD"] = str(status_write)
+        env["FORKSERVER_INPUT"] = self.input_file
+        env["FORKSERVER_OUTPUT"] = self.output_file
+        self.process = subprocess.Popen(
+            [self.sqlite3, self.db_file],
+            stdin=subprocess.DEVNULL,
+            env=env,
+            pass_fds=(ctl_read, status_write),
+        )
+        os.close(ctl_read)
+        os.close(status_write)
+
+    def stop(self):
+        if self.process is None:
+            return
+        # The server exits once the control pipe is closed.
+        os.close(self.ctl)
+        os.close(self.status)
+        try:
+            self.process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read_status(self, timeout):
+        ready, _, _ = select.select([self.status], [], [], timeout)
+        data = os.read(self.status, 4) if ready else b""
+        return struct.unpack("=I", data)[0] if len(data) == 4 else None
+
+    def run(self, script):
+        """Run `script` in a fresh child and return its output and wait
+        status. A child that hangs is killed; None as status means that the
+        server itself is gone, it is restarted on the next run."""
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+        with open(self.input_file, "wb") as f:
+            f.write(script)
+        try:
+            os.write(self.ctl, b"\0\0\0\0")
+        except BrokenPipeError:
+            pid = None
+        else:
+            pid = self.read_status(self.timeout)
+        status = None
+        if pid is not None:
+            status = self.read_status(self.timeout)
+            if status is None:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGKILL)
+                status = self.read_status(self.timeout)
+        if status is None:
+            self.stop()
+        try:
+            with open(self.output_file, "rb") as f:
+                return f.read(), status
+        except FileNotFoundError:
+            return b"", status
+
+
+class SQLiteWorkerPool:
+    """Round-robin dispatch of statements over several SQLiteWorkers, or
+    LibraryWorkers.
+
+    `submit` does not wait for the statement it sends. It only collects the
+    previous result of the worker it reuses, so sqlite3 executes while the
+    fuzzer generates the next input."""
+
+    def __init__(
+        self,
+        sqlite3,
+        db_files,
+        max_statements=1000,
+        timeout=10.0,
+        env=None,
+        edge_feedback=None,
+        worker_class=SQLiteWorker,
+    ):
+        self.workers = [
+            worker_class(sqlite3, db_file, max_statements, timeout, env, edge_feedback)
+            for db_file in db_files
+        ]
+        self.next_worker = 0
+
+    def submit(self, sqlcmd):
+        done = self.submit_batch([sqlcmd])
+        return done[0] if done else None
+
+    def submit_batch(self, sqlcmds):
+        """Send a batch of statements to the next worker in one write and
+        return the results of the batch it had before."""
+        worker = self.workers[self.next_worker]
+        self.next_worker = (self.next_worker + 1) % len(self.workers)
+        done = worker.receive_batch() if worker.pending else []
+        worker.send_batch(sqlcmds)
+        return done
+
+    def drain(self):
+        done = []
+        for worker in self.workers:
+            if worker.pending:
+                done += worker.receive_batch()
+        return done
+
+    def stop(self):
+        done = self.drain()
+        for worker in self.workers:
+            worker.stop()
+        return done
+
+
+class SchemaSync:
+    """Reconciles the schema model in grammar.store with the databases that
+    sqlite3 actually writes, read through Python's sqlite3 module. The schema
+    is only read when PRAGMA schema_version says that it changed."""
+
+    def __init__(self, db_files):
+        self.db_files = db_files
+        self.versions = {}
+
+    def connect(self, db_file):
+        # Never wait for a worker's lock, the next batch can sync instead.
+        return sqlite3.connect(
+            f"file:{db_file}?mode=ro", uri=True, timeout=0, isolation_level=None
+        )
+
+    def read_version(self, db_file):
+        try:
+            with contextlib.closing(self.connect(db_file)) as connection:
+                return connection.execute("PRAGMA schema_version").fetchone()[0]
+        except sqlite3.Error:
+            # Not created yet, or locked by a worker: try again next time.
+            return self.versions.get(db_file)
+
+    def changed(self):
+        return any(
+            self.read_version(db_file) != self.versions.get(db_file)
+            for db_file in self.db_files
+        )
+
+    def read_schema(self, connection, tables):
+        for table_name, column_name, column_type, pk in connection.execute(
+            "SELECT m.name, c.name, c.type, c.pk FROM sqlite_schema AS m, "
+            "pragma_table_info(m.name) AS c "
+            "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'"
+        ):
+            columns, has_primary_key, indices = tables.get(
+                table_name, ({}, False, set())
+            )
+            columns[column_name] = column_type or None
+            tables[table_name] = (columns, has_primary_key or pk > 0, indices)
+        for index_name, table_name in connection.execute(
+            "SELECT name, tbl_name FROM sqlite_schema "
+            "WHERE type = 'index' AND name NOT LIKE 'sqlite_%'"
+        ):
+            if table_name in tables:
+                tables[table_name][2].add(index_name)
+
+    def sync(self, store):
+        # With several workers the model covers the union of their schemas.
+        tables = {}
+        try:
+            for db_file in self.db_files:
+                with contextlib.closing(self.connect(db_file)) as connection:
+                    connection.execute("BEGIN")
+                    version = connection.execute("PRAGMA schema_version").fetchone()[0]
+                    self.read_schema(connection, tables)
+                self.versions[db_file] = version
+        except sqlite3.Error:
+            return False
+        store.reconcile(tables)
+        return True
+
+
+GCOV_TAG_FUNCTION = 0x01000000
+GCOV_TAG_BLOCKS = 0x01410000
+GCOV_TAG_ARCS = 0x01430000
+GCOV_TAG_LINES = 0x01450000
+GCOV_TAG_COUNTER_ARCS = 0x01A10000
+GCOV_ARC_ON_TREE = 1
+GCOV_ARC_FAKE = 2
+
+
+class GcovFunction:
+    def __init__(self, ident):
+        self.ident = ident
+        self.n_blocks = 0
+        self.arcs = []  # (src, dst, flags)
+        self.block_lines = {}  # block -> (filename, last line of the block)
+        self.branches = []  # indices into self.arcs
+
+    def finish(self, source, source_lines):
+        self.in_arcs = [[] for _ in range(self.n_blocks)]
+        self.out_arcs = [[] for _ in range(self.n_blocks)]
+        self.counted = []
+        for i, (src, dst, flags) in enumerate(self.arcs):
+            self.out_arcs[src].append(i)
+            self.in_arcs[dst].append(i)
+            if not flags & GCOV_ARC_ON_TREE:
+                self.counted.append(i)
+
+        # Like gcov, every non-fake arc of a block with several non-fake
+        # successors is a branch on the last line of that block. Like gcovr's
+        # --exclude-unreachable-branches, lines without real code are skipped.
+        for block, arcs in enumerate(self.out_arcs):
+            filename, line = self.block_lines.get(block, (None, 0))
+            if filename is None or os.path.basename(filename) != source:
+                continue
+            if not line_can_contain_branches(source_lines[line - 1]):
+                continue
+            real_arcs = [a for a in arcs if not self.arcs[a][2] & GCOV_ARC_FAKE]
+            if len(real_arcs) > 1:
+                self.branches.extend(real_arcs)
+
+    def count_taken_branches(self, counters):
+        """Solve the arc counts from the instrumented (off-tree) counters by
+        flow conservation and count the branches that were taken."""
+        counts = [None] * len(self.arcs)
+        for arc, value in zip(self.counted, counters):
+            counts[arc] = value
+        block_counts = [None] * self.n_blocks
+        changed = True
+        while changed:
+            changed = False
+            for block in range(self.n_blocks):
+                sides = (self.out_arcs[block], self.in_arcs[block])
+                if block_counts[block] is None:
+                    for arcs in sides:
+                        if arcs and all(counts[a] is not None for a in arcs):
+                            block_counts[block] = sum(counts[a] for a in arcs)
+                            changed = True
+                            break
+                    else:
+                        continue
+                for arcs in sides:
+                    unknown = [a for a in arcs if counts[a] is None]
+                    if len(unknown) == 1:
+                        known = sum(counts[a] for a in arcs if counts[a] is not None)
+                        counts[unknown[0]] = block_counts[block] - known
+                        changed = True
+        return sum(1 for a in self.branches if counts[a])
+
+
+def line_can_contain_branches(code):
+    # Same heuristic as gcovr's --exclude-unreachable-branches.
+    code = re.sub(r"//.*?$", "", code)
+    code = re.sub(r"/\*.*?\*/", "", code)
+    code = re.sub(r"\s+", "", code)
+    return code not in ["", "{", "}", "{}"]
+
+
+class GcovReader:
+    """Branch coverage read directly from the .gcno/.gcda files.
+
+    The control flow graph in the .gcno file is parsed once. A measurement only
+    reads the .gcda counters, and functions whose counters did not change
+    since the previous measurement are not solved again. The result is the
+    sqlite3.c branch_percent that `gcovr --branches
+    --exclude-unreachable-branches` reports."""
+
+    def __init__(self, gcno_file, source="sqlite3.c"):
+        self.gcno_file = gcno_file
+        self.source = os.path.basename(source)
+        source_path = os.path.join(os.path.dirname(gcno_file), source)
+        with open(source_path, errors="replace") as f:
+            source_lines = f.read().split("\n")
+        self.functions = {}
+        for function in self.read_notes(gcno_file):
+            function.finish(self.source, source_lines)
+            self.functions[function.ident] = function
+        self.branch_total = sum(len(f.branches) for f in self.functions.values())
+        self.cache = {}  # ident -> (counters, taken branches)
+
+    def read_header(self, data, magic):
+        assert data[:4] == magic[::-1], f"not a {magic.decode()} file"
+        version = data[4:8][::-1]
+        major = (version[0] - ord("A")) * 10 + version[1] - ord("0")
+        # GCC 12 switched record lengths and strings from words to bytes and
+        # added a checksum to the header.
+        self.unit = 1 if major >= 12 else 4
+        return 16 if major >= 12 else 12
+
+    def read_string(self, data, pos):
+        (length,) = struct.unpack_from("<I", data, pos)
+        pos += 4 + length * self.unit
+        return data[pos - length * self.unit : pos].split(b"\0", 1)[0].decode(), pos
+
+    def read_records(self, data, pos):
+        while pos + 8 <= len(data):
+            tag, length = struct.unpack_from("<II", data, pos)
+            pos += 8
+            if length >= 1 << 31:
+                # A negative length stands for counters that are all zero
+                # and are not stored in the file.
+                yield tag, pos, pos, (1 << 32) - length
+                continue
+            yield tag, pos, pos + length * self.unit, 0
+            pos += length * self.unit
+
+    def read_notes(self, gcno_file):
+        with open(gcno_file, "rb") as f:
+            data = f.read()
+        pos = self.read_header(data, b"gcno")
+        _, pos = self.read_string(data, pos)  # cwd
+        pos += 4  # has_unexecuted_blocks
+
+        function = None
+        for tag, start, end, _ in self.read_records(data, pos):
+            if tag == GCOV_TAG_FUNCTION:
+                if function is not None:
+                    yield function
+                function = GcovFunction(struct.unpack_from("<I", data, start)[0])
+            elif tag == GCOV_TAG_BLOCKS:
+                function.n_blocks = struct.unpack_from("<I", data, start)[0]
+            elif tag == GCOV_TAG_ARCS:
+                values = struct.unpack_from(f"<{(end - start) // 4}I", data, start)
+                src = values[0]
+                for i in range(1, len(values), 2):
+                    function.arcs.append((src, values[i], values[i + 1]))
+            elif tag == GCOV_TAG_LINES:
+                (block,) = struct.unpack_from("<I", data, start)
+                pos = start + 4
+                filename = None
+                location = None
+                while pos < end:
+                    (line,) = struct.unpack_from("<I", data, pos)
+                    pos += 4
+                    if line:
+                        location = (filename, line)
+                        continue
+                    filename, pos = self.read_string(data, pos)
+                    if not filename:
+                        break
+                if location is not None:
+                    function.block_lines[block] = location
+        if function is not None:
+            yield function
+
+    def read_counters(self, gcda_file, counters):
+        with open(gcda_file, "rb") as f:
+            data = f.read()
+        pos = self.read_header(data, b"gcda")
+        ident = None
+        for tag, start, end, zeros in self.read_records(data, pos):
+            if tag == GCOV_TAG_FUNCTION:
+                ident = struct.unpack_from("<I", data, start)[0] if end > start else None
+            elif tag == GCOV_TAG_COUNTER_ARCS and ident in self.functions:
+                if zeros:
+                    values = (0,) * (zeros // (8 // self.unit))
+                else:
+                    values = struct.unpack_from(f"<{(end - start) // 8}Q", data, start)
+                if ident in counters:
+                    values = tuple(map(sum, zip(counters[ident], values)))
+                counters[ident] = values
+
+    def get_coverage(self, gcda_files):
+        """Return (branch_percent, covered, total) for the summed counters of
+        `gcda_files`, e.g. the .gcda files of several parallel jobs."""
+        counters = {}
+        for gcda_file in gcda_files:
+            if os.path.exists(gcda_file):
+                self.read_counters(gcda_file, counters)
+
+        covered = 0
+        for ident, values in counters.items():
+            cached = self.cache.get(ident)
+            if cached is None or cached[0] != values:
+                cached = (values, self.functions[ident].count_taken_branches(values))
+                self.cache[ident] = cached
+            covered += cached[1]
+        percent = round(covered / self.branch_total, 3) if self.branch_total else 0
+        return percent, covered, self.branch_total
+
+
+def gcov_prefix_env(prefix):
+    # sqlite3 writes its .gcda files to the absolute path of the build
+    # directory. Strip that path so that they end up directly in `prefix`.
+    build_directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["GCOV_PREFIX"] = os.path.abspath(prefix)
+    env["GCOV_PREFIX_STRIP"] = str(len(build_directory.strip(os.sep).split(os.sep)))
+    return env
+
+
+def run_job(index, runs, plot_every_x, barrier, experiment_kwargs):
+    # Runs in a forked process: one Fuzzer, database and .gcda directory per job.
+    experiment = None
+    try:
+        experiment = Experiment(
+            db_file=f"job-{index}.db",
+            gcov_prefix=os.path.join(GCOV_JOBS_DIR, f"job-{index}"),
+            **experiment_kwargs,
+        )
+        for start in range(0, runs[-1], plot_every_x):
+            experiment.generate_and_run(min(start + plot_every_x, runs[index]) - start)
+            experiment.flush()
+            # Wait until every job reached the checkpoint, then until the
+            # coverage of all jobs has been merged.
+            barrier.wait()
+            barrier.wait()
+        experiment.flush()
+    except BaseException:
+        # Do not leave the other jobs and the parent waiting for this one.
+        barrier.abort()
+        raise
+    finally:
+        # The process exits with os._exit, which skips the atexit handlers.
+        if experiment is not None:
+            experiment.close()
+
+
+class Experiment:
+    def __init__(
+        self,
+        backend="shell",
+        workers=1,
+        max_statements=1000,
+        db_file="empty.db",
+        gcov_prefix=None,
+        coverage="gcovr",
+        edges=False,
+        batch_size=1,
+        sync_schema=False,
+        session_size=0,
+        timeout=10.0,
+        dedup_size=0,
+        measure_only=False,
+    ):
         random.seed()
         self.fuzzer = Fuzzer()
-        self.db_file = "empty.db"
-        self.sqlite3 = self.find_sqlite3_executable()
+        self.db_file = db_file
+        if backend == "library":
+            if edges:
+                raise ValueError("--edges needs the sqlite3-edges binary, not the library")
+            self.sqlite3 = self.find_sqlite3_executable("libsqlite3.so")
+        else:
+            self.sqlite3 = self.find_sqlite3_executable("sqlite3-edges" if edges else "sqlite3")
+        self.env = None if gcov_prefix is None else gcov_prefix_env(gcov_prefix)
+        self.gcov_prefix = gcov_prefix
+        self.coverage = coverage
+        self.gcov_reader = None
+        self.edge_feedback = EdgeFeedback() if edges else None
+        self.edge_map = None
+        self.new_edges = None
+        self.batch_size = batch_size
+        self.timeout = timeout
+        # Scripts that sqlite3 died on, with the signal (negative) or None
+        # for a timeout. The pool backends restart their workers instead.
+        self.crashes = []
+        # With sessions, every session_size statements form one script for
+        # a fresh database, see start_session
+        self.session_size = session_size
+        self.session = []
+        # Inputs run so far and, in a campaign, the seconds it has been
+        # running and its (time, execs, execs/sec, branch %) rows
+        self.execs = 0
+        self.elapsed = 0.0
+        self.series = []
+        # Recent inputs, to regenerate near-duplicates instead of running them
+        self.dedup = InputDedup(dedup_size) if dedup_size else None
+        if session_size:
+            if backend in ("pool", "library") and workers > 1:
+                raise ValueError("sessions need a single database, use --workers 1")
+            self.batch_size = session_size
+        # The parent of --jobs only builds, cleans and measures coverage, so
+        # it starts no workers, fork server or edge map of its own.
+        self.backend = backend
+        self.pool = None
+        self.fork_server = None
+        if measure_only:
+            backend = edges = None
+        if backend in ("pool", "library"):
+            if workers == 1:
+                db_files = [self.db_file]
+            else:
+                name, ext = os.path.splitext(self.db_file)
+                db_files = [f"{name}-{i}{ext}" for i in range(workers)]
+            self.pool = SQLiteWorkerPool(
+                self.sqlite3,
+                db_files,
+                max_statements,
+                timeout=timeout,
+                env=self.env,
+                edge_feedback=self.edge_feedback,
+                worker_class=LibraryWorker if backend == "library" else SQLiteWorker,
+            )
+        elif edges:
+            self.edge_map = EdgeMap()
+            self.env = self.edge_map.get_env(self.env)
+        if backend == "forkserver":
+            self.fork_server = ForkServer(
+                self.sqlite3, self.db_file, timeout=timeout, env=self.env
+            )
+        self.schema_sync = None
+        if sync_schema:
+            self.schema_sync = SchemaSync(self.get_db_files())
+
+    def get_db_files(self):
+        if self.pool is not None:
+            return [worker.db_file for worker in self.pool.workers]
+        return [self.db_file]
 
-    def find_sqlite3_executable(self):
+    def find_sqlite3_executable(self, name="sqlite3"):
         # Try to find sqlite3 in the current working directory or the script's directory
         script_directory = os.path.dirname(os.path.abspath(__file__))
-        script_sqlite3_path = os.path.join(script_directory, "sqlite3")
+        script_sqlite3_path = os.path.join(script_directory, name)
 
         if os.path.exists(script_sqlite3_path):
             return script_sqlite3_path
@@ -38,25 +994,132 @@ class Experiment:
             "sqlite3 executable not found. Please set the path manually."
         )
 
+    def close(self):
+        """Stop the fork server and remove its files and the edge maps."""
+        if self.fork_server is not None:
+            self.fork_server.close()
+        if self.edge_map is not None:
+            self.edge_map.close()
+        if self.pool is not None:
+            for worker in self.pool.workers:
+                if worker.edge_map is not None:
+                    worker.edge_map.close()
+
     def run(self, sqlcmd):
-        command = f'echo "{sqlcmd}" | {self.sqlite3} {self.db_file}'
+        if self.pool is not None:
+            done = self.pool.submit(sqlcmd)
+            if done is not None:
+                self.check_output(*done)
+            return
+        self.run_batch([sqlcmd])
+
+    def execute(self, script):
+        """Run `script` in a fresh sqlite3. The SQL goes through stdin, never
+        through a shell. Returns the output and the exit status, which is
+        negative for a signal and None after a timeout."""
         process = subprocess.Popen(
-            command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            [self.sqlite3, self.db_file],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=self.env,
         )
-        output, error = process.communicate()
+        try:
+            output, _ = process.communicate(script, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            output, _ = process.communicate()
+            return output, None
+        return output, process.returncode
+
+    def run_batch(self, sqlcmds):
+        # The whole batch goes to sqlite3 in a single write.
+        if self.pool is not None:
+            for done in self.pool.submit_batch(sqlcmds):
+                self.check_output(*done)
+            if len(self.pool.workers) > 1:
+                # The next batch goes to another connection.
+                store.commit()
+            return
+
+        if self.edge_map is not None:
+            self.edge_map.reset()
+        script = encode_statements(sqlcmds)
+        if self.fork_server is not None:
+            output, status = self.fork_server.run(script)
+            if status is not None:
+                status = os.waitstatus_to_exitcode(status)
+        else:
+            output, status = self.execute(script)
+        # Every script runs in its own sqlite3 process, which rolls back a
+        # transaction that the script left open when it exits.
+        store.rollback()
+        if status is None or status < 0:
+            # Killed after the timeout (None) or by a signal
+            self.crashes.append((script, status))
+
+        new_edges = [None] * len(sqlcmds)
+        if self.edge_map is not None:
+            new_edges[-1] = self.edge_feedback.get_new_edges(self.edge_map)
+        outputs = split_outputs(output, len(sqlcmds))
+        for sqlcmd, output, edges in zip(sqlcmds, outputs, new_edges):
+            self.check_output(sqlcmd, output, edges)
 
-        # print(f"sqlcmd: {sqlcmd}")  # remove
-        # print(f"output: {output}")  # remove
-        # print()  # remove
+    def sync_schema(self):
+        # Pool workers may still run the last batch. Tables and columns it
+        # creates drop out of the model until a later sync reads them back,
+        # which is cheaper than waiting for the batch.
+        if self.schema_sync is not None and self.schema_sync.changed():
+            self.schema_sync.sync(store)
 
+    def flush(self):
+        # Wait for in-flight statements and let the workers exit, so that
+        # their coverage counters are on disk before gcovr reads them.
+        if self.pool is not None:
+            for done in self.pool.stop():
+                self.check_output(*done)
+
+    def check_output(self, sqlcmd, output, new_edges=None):
+        # With the pool backend this is called once the result arrives, which
+        # can be after the next input has been submitted.
+        self.new_edges = new_edges
+        if new_edges is not None:
+            self.fuzzer.report(sqlcmd, new_edges)
         if len(output) and "CREATE" in sqlcmd:
             print(f"sqlcmd: {sqlcmd}")  # remove
             print(f"output: {output}")  # remove
             print("\a")
 
-    def get_coverage(self):
+    def get_gcov_reader(self):
+        # The .gcno notes only exist after `make`, so parse them lazily.
+        if self.gcov_reader is None:
+            script_directory = os.path.dirname(os.path.abspath(__file__))
+            binary = os.path.basename(self.sqlite3)
+            for name in [f"{binary}-sqlite3.gcno", "sqlite3.gcno"]:
+                gcno_file = os.path.join(script_directory, name)
+                if os.path.exists(gcno_file):
+                    self.gcov_reader = GcovReader(gcno_file)
+                    break
+            else:
+                raise FileNotFoundError("sqlite3.gcno not found. Run make first.")
+        return self.gcov_reader
+
+    def get_gcda_files(self, directory):
+        reader = self.get_gcov_reader()
+        gcda_name = os.path.basename(reader.gcno_file)[: -len(".gcno")] + ".gcda"
+        return [os.path.join(directory, gcda_name)]
+
+    def get_coverage(self, search_path=""):
+        self.flush()
+        if self.coverage == "gcda":
+            directory = search_path or self.gcov_prefix or "."
+            percent, _, _ = self.get_gcov_reader().get_coverage(
+                self.get_gcda_files(directory)
+            )
+            return percent
+
         coverage_report_file = "coverage_report.csv"
-        gcovr_command = f"gcovr --csv --branches --exclude-unreachable-branches -o {coverage_report_file}"
+        gcovr_command = f"gcovr --csv --branches --exclude-unreachable-branches -o {coverage_report_file} {search_path}"
         subprocess.run(gcovr_command, shell=True, check=True)
 
         with open(coverage_report_file, "r") as f:
@@ -71,8 +1134,36 @@ class Experiment:
             assert branch_cov_percent is not None
         return branch_cov_percent
 
+    def get_merged_coverage(self, jobs):
+        """Merge the .gcda files of all jobs with gcov-tool and measure the
+        branch coverage of the whole campaign."""
+        merged = os.path.join(GCOV_JOBS_DIR, "merged")
+        shutil.rmtree(merged, ignore_errors=True)
+        job_dirs = [os.path.join(GCOV_JOBS_DIR, f"job-{i}") for i in range(jobs)]
+        job_dirs = [d for d in job_dirs if glob.glob(os.path.join(d, "*.gcda"))]
+        if not job_dirs:
+            return 0
+        if self.coverage == "gcda":
+            # The reader sums the counters itself, no merge step needed.
+            gcda_files = sum((self.get_gcda_files(d) for d in job_dirs), [])
+            percent, _, _ = self.get_gcov_reader().get_coverage(gcda_files)
+            return percent
+        shutil.copytree(job_dirs[0], merged)
+        for job_dir in job_dirs[1:]:
+            subprocess.run(
+                ["gcov-tool", "merge", "-o", merged + ".tmp", merged, job_dir],
+                check=True,
+            )
+            shutil.rmtree(merged)
+            os.rename(merged + ".tmp", merged)
+        # gcov expects the .gcno notes next to the merged .gcda counters.
+        for gcno in glob.glob("*.gcno"):
+            os.symlink(os.path.abspath(gcno), os.path.join(merged, gcno))
+        return self.get_coverage(search_path=merged)
+
     def clean(self):
         print("Cleaning up project directory for a new measurement...")
+        self.flush()
         # Delete old empty.db, PDFs, coverage reports
         subprocess.run(
             "make clean",
@@ -83,7 +1174,8 @@ class Experiment:
         )
         # Build sqlite and .gcno if not exists.
         subprocess.run(
-            "make",
+            f"make {os.path.basename(self.sqlite3)}"
+            + (" forkserver.so" if self.backend == "forkserver" else ""),
             shell=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -91,8 +1183,41 @@ class Experiment:
         )
         print("Done.")
 
-    def generate_and_run(self):
-        self.run(self.fuzzer.fuzz_one_input())
+    def start_session(self):
+        # Let the pool worker exit before its database goes away.
+        self.flush()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.db_file)
+        self.session = self.fuzzer.fuzz_session(self.session_size)
+
+    def deduplicate(self, sqlcmd):
+        # Sessions are not deduplicated, the same statement on another
+        # database is another test.
+        if self.dedup is not None:
+            for _ in range(DEDUP_ATTEMPTS):
+                if self.dedup.add(sqlcmd):
+                    break
+                sqlcmd = self.fuzzer.fuzz_one_input()
+        return sqlcmd
+
+    def generate_and_run(self, n=1):
+        # Runs n inputs, in batches of batch_size. A session that is cut
+        # short by n continues in the next call, on the same database.
+        while n > 0:
+            size = min(n, self.batch_size)
+            if self.session_size:
+                if not self.session:
+                    self.start_session()
+                size = min(size, len(self.session))
+                self.run_batch(self.session[:size])
+                del self.session[:size]
+            elif size == 1:
+                self.run(self.deduplicate(self.fuzzer.fuzz_one_input()))
+            else:
+                self.run_batch(self.fuzzer.fuzz_batch(size, each=self.deduplicate))
+            self.sync_schema()
+            self.execs += size
+            n -= size
 
     def generate_and_run_k_plot_coverage(self, k, plot_every_x):
         from time import time
@@ -102,10 +1227,17 @@ class Experiment:
         cov = []
         old_cov = 0
         tic = time()
-        for i in range(k):
+        i = 0
+        while i < k:
             # print("Generate and run input ", i)
-            self.generate_and_run()
-            if plot_every_x != -1 and i % plot_every_x == 0:
+            n = min(self.batch_size, k - i)
+            if plot_every_x != -1:
+                # A batch ends at the next input that is followed by a measurement.
+                n = min(n, -i % plot_every_x + 1)
+            self.generate_and_run(n)
+            cov += [old_cov] * (n - 1)
+            i += n
+            if plot_every_x != -1 and (i - 1) % plot_every_x == 0:
                 old_cov = self.get_coverage()
             cov.append(old_cov)
 
@@ -114,14 +1246,206 @@ class Experiment:
         print(f"time taken: {toc-tic} seconds")
         print("\a")
         cov.append(self.get_coverage())
+        if self.edge_feedback is not None:
+            print(f"edges found: {self.edge_feedback.total}")
+        if self.crashes:
+            print(f"crashes and timeouts: {len(self.crashes)}")
+        if self.dedup is not None:
+            print(f"near-duplicates regenerated: {self.dedup.duplicates}")
+        coverage = self.fuzzer.coverage
+        print(f"grammar expansions covered: {coverage.count()} of {len(coverage)}")
 
         plot(x=list(range(len(cov))), y=cov)
 
+    def save_state(self, state_dir):
+        """Save the campaign to state_dir: the fuzzer's corpus and schedule,
+        the schema model, the databases and the .gcda counters. The new
+        checkpoint is written next to the old one and only replaces it once
+        it is complete, so a run that is killed meanwhile keeps the old one."""
+        self.flush()
+        checkpoint = os.path.join(state_dir, CHECKPOINT_DIR)
+        partial = checkpoint + ".tmp"
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        files = [f for f in self.get_db_files() if os.path.exists(f)]
+        files += glob.glob(os.path.join(self.gcov_prefix or ".", "*.gcda"))
+        for path in files:
+            shutil.copy(path, partial)
+        state = {
+            "elapsed": self.elapsed,
+            "execs": self.execs,
+            "series": self.series,
+            "files": files,
+            "fuzzer": self.fuzzer.get_state(),
+            "store": store.get_state(),
+            "edges": None
+            if self.edge_feedback is None
+            else (self.edge_feedback.seen, self.edge_feedback.total),
+            "crashes": self.crashes,
+        }
+        with open(os.path.join(partial, "state.pickle"), "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(checkpoint):
+            os.rename(checkpoint, checkpoint + ".old")
+        os.rename(partial, checkpoint)
+        shutil.rmtree(checkpoint + ".old", ignore_errors=True)
+
+        series_file = os.path.join(state_dir, TIME_SERIES_FILE)
+        with open(series_file + ".tmp", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "execs", "execs_per_sec", "branch_percent"])
+            writer.writerows(self.series)
+        os.replace(series_file + ".tmp", series_file)
+
+    def load_state(self, state_dir):
+        """Restore the campaign saved in state_dir. Returns False if there
+        is no checkpoint."""
+        checkpoint = os.path.join(state_dir, CHECKPOINT_DIR)
+        if not os.path.exists(checkpoint):
+            # Killed between the two renames of save_state
+            checkpoint += ".old"
+        if not os.path.exists(checkpoint):
+            return False
+        with open(os.path.join(checkpoint, "state.pickle"), "rb") as f:
+            state = pickle.load(f)
+        for path in state["files"]:
+            shutil.copy(os.path.join(checkpoint, os.path.basename(path)), path)
+        self.elapsed = state["elapsed"]
+        self.execs = state["execs"]
+        self.series = state["series"]
+        self.fuzzer.set_state(state["fuzzer"])
+        store.set_state(state["store"])
+        if self.edge_feedback is not None and state["edges"] is not None:
+            self.edge_feedback.seen, self.edge_feedback.total = state["edges"]
+        self.crashes = state["crashes"]
+        return True
+
+    def checkpoint(self, state_dir):
+        branch_percent = self.get_coverage()
+        execs_per_sec = self.execs / self.elapsed if self.elapsed else 0.0
+        self.series.append(
+            (round(self.elapsed, 1), self.execs, round(execs_per_sec, 1), branch_percent)
+        )
+        self.save_state(state_dir)
+        print(
+            f"{self.elapsed:8.0f} s {self.execs:>10} execs {execs_per_sec:>8.1f}/s"
+            f" {branch_percent:>7.1%} branches"
+        )
+
+    def run_campaign(self, duration, checkpoint_interval, state_dir, resume=False):
+        """Fuzz until `duration` seconds of wall-clock time have passed,
+        counting the time before a resume. Every `checkpoint_interval`
+        seconds, and at the end, the coverage is measured and the campaign
+        saved to state_dir, see save_state. SIGTERM ends the campaign at the
+        next input, with a checkpoint."""
+        os.makedirs(state_dir, exist_ok=True)
+        if resume and self.load_state(state_dir):
+            print(f"Resuming after {self.elapsed:.0f} s and {self.execs} inputs")
+        else:
+            self.clean()
+
+        stopped = []
+        handler = signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+        start = time.monotonic() - self.elapsed
+        next_checkpoint = self.elapsed + checkpoint_interval
+        try:
+            while self.elapsed < duration and not stopped:
+                self.generate_and_run(self.batch_size)
+                self.elapsed = time.monotonic() - start
+                if next_checkpoint <= self.elapsed < duration:
+                    # The last one follows the loop
+                    self.checkpoint(state_dir)
+                    next_checkpoint = self.elapsed + checkpoint_interval
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+        self.checkpoint(state_dir)
+        if stopped:
+            print("Stopped by SIGTERM, continue with --resume")
+        if self.edge_feedback is not None:
+            print(f"edges found: {self.edge_feedback.total}")
+        if self.crashes:
+            print(f"crashes and timeouts: {len(self.crashes)}")
+        if self.dedup is not None:
+            print(f"near-duplicates regenerated: {self.dedup.duplicates}")
+        coverage = self.fuzzer.coverage
+        print(f"grammar expansions covered: {coverage.count()} of {len(coverage)}")
+
+        plot(x=[row[1] for row in self.series], y=[row[3] for row in self.series])
+
+    def wait_for_jobs(self, barrier, processes):
+        """Wait at `barrier` until every job arrived. A job that exited
+        before, with an exception or killed by a signal, aborts the barrier.
+        The other jobs then stop at their next checkpoint."""
+        # Barrier.wait with a timeout would break the barrier for jobs that
+        # are still working, so poll until all of them are waiting.
+        while barrier.n_waiting < len(processes):
+            if any(process.exitcode is not None for process in processes):
+                barrier.abort()
+                break
+            time.sleep(0.1)
+        try:
+            barrier.wait(timeout=BARRIER_TIMEOUT)
+        except threading.BrokenBarrierError:
+            for process in processes:
+                process.join(BARRIER_TIMEOUT)
+                if process.exitcode is None:
+                    process.terminate()
+                    process.join()
+            exitcodes = [process.exitcode for process in processes]
+            raise RuntimeError(f"a fuzzing job failed, exit codes: {exitcodes}")
+
+    def generate_and_run_k_parallel(self, k, plot_every_x, jobs, **experiment_kwargs):
+        from time import time
+
+        self.clean()
+        shutil.rmtree(GCOV_JOBS_DIR, ignore_errors=True)
+
+        runs = [k // jobs + (i < k % jobs) for i in range(jobs)]
+        # run_job reads the largest share from runs[-1] to agree on the
+        # number of checkpoints, so keep the list sorted.
+        runs.sort()
+        if plot_every_x == -1:
+            plot_every_x = max(runs[-1], 1)
+        checkpoints = -(-runs[-1] // plot_every_x)
+
+        context = multiprocessing.get_context("fork")
+        barrier = context.Barrier(jobs + 1)
+        processes = [
+            context.Process(
+                target=run_job,
+                args=(i, runs, plot_every_x, barrier, experiment_kwargs),
+            )
+            for i in range(jobs)
+        ]
+        tic = time()
+        for process in processes:
+            process.start()
+
+        x = [0]
+        cov = [0]
+        for checkpoint in range(checkpoints):
+            self.wait_for_jobs(barrier, processes)
+            done = sum(min((checkpoint + 1) * plot_every_x, r) for r in runs)
+            x.append(done)
+            cov.append(self.get_merged_coverage(jobs))
+            self.wait_for_jobs(barrier, processes)
+
+        for process in processes:
+            process.join()
+        toc = time()
+        print(f"time taken: {toc-tic} seconds")
+        print("\a")
+
+        plot(x=x, y=cov)
+
 
 def main():
     parser = argparse.ArgumentParser(description="SQL fuzzer and coverage plotter")
     parser.add_argument(
-        "runs", type=int, help="How many inputs should be generated and run?"
+        "runs",
+        nargs="?",
+        type=int,
+        help="How many inputs should be generated and run? Not needed with --duration",
     )
     parser.add_argument(
         "--plot-every-x",
@@ -129,12 +1453,134 @@ def main():
         type=int,
         help="Coverage will be measured after plot_every_x. (default:-1, i.e. there is only one coverage measurement at the end)",
     )
+    parser.add_argument(
+        "--backend",
+        default="shell",
+        choices=["shell", "pool", "library", "forkserver"],
+        help="shell: one sqlite3 pipeline per input, pool: long-lived sqlite3 workers, library: workers that run libsqlite3.so (make libsqlite3.so) in a forked child, forkserver: one sqlite3 child per input or batch, forked from an initialized sqlite3 (make forkserver.so) (default: shell)",
+    )
+    parser.add_argument(
+        "--workers",
+        default=1,
+        type=int,
+        help="Number of workers of the pool and library backends, each with its own database (default: 1)",
+    )
+    parser.add_argument(
+        "--max-statements",
+        default=1000,
+        type=int,
+        help="Restart a pool worker after this many statements (default: 1000)",
+    )
+    parser.add_argument(
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of parallel fuzzing jobs, each with its own fuzzer, database and coverage counters (default: 1)",
+    )
+    parser.add_argument(
+        "--coverage",
+        default="gcovr",
+        choices=["gcovr", "gcda"],
+        help="gcovr: run gcovr for every measurement, gcda: read the .gcda counters directly (default: gcovr)",
+    )
+    parser.add_argument(
+        "--edges",
+        action="store_true",
+        help="Run the sqlite3-edges build (make sqlite3-edges) and count new edges after every input",
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=1,
+        type=int,
+        help="Generate inputs in batches of this size and pipe each batch to sqlite3 in one write. With --edges, new edges are only known per batch (default: 1)",
+    )
+    parser.add_argument(
+        "--sync-schema",
+        action="store_true",
+        help="After every batch, reconcile the fuzzer's schema model with the tables, columns and indices in the database",
+    )
+    parser.add_argument(
+        "--short-names",
+        action="store_true",
+        help="Generate identifiers of %d-%d letters instead of 10-15, for shorter inputs that parse faster" % SHORT_NAME_LENGTHS,
+    )
+    parser.add_argument(
+        "--session-size",
+        default=0,
+        type=int,
+        help="Generate sessions of this many statements, each run as one script on a fresh database. Overrides --batch-size (default: 0, no sessions)",
+    )
+    parser.add_argument(
+        "--timeout",
+        default=10.0,
+        type=float,
+        help="Seconds before a hanging sqlite3 is killed (default: 10)",
+    )
+    parser.add_argument(
+        "--dedup",
+        default=0,
+        type=int,
+        metavar="SIZE",
+        help="Regenerate inputs that equal one of the last SIZE inputs once names, strings and numbers are abstracted. Statements that change the schema always run (default: 0, off)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="Run a campaign for this many seconds instead of a number of inputs, with checkpoints in --state-dir",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        default=300.0,
+        type=float,
+        help="With --duration, measure the coverage and save the campaign every this many seconds (default: 300)",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default="campaign",
+        help="Where --duration writes its checkpoint and the coverage time series, coverage.csv (default: campaign)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="With --duration, continue the campaign saved in --state-dir",
+    )
     args = parser.parse_args()
     runs = args.runs
+    if args.duration is None and runs is None:
+        parser.error("either runs or --duration is required")
+    if args.duration is not None and args.jobs > 1:
+        parser.error("--duration runs a single job")
+    if args.short_names:
+        # Set before the jobs are forked, so that they inherit it
+        name_pool.set_lengths(*SHORT_NAME_LENGTHS)
     plot_every_x = args.plot_every_x
 
-    experiment = Experiment()
-    experiment.generate_and_run_k_plot_coverage(runs, plot_every_x)
+    experiment_kwargs = dict(
+        backend=args.backend,
+        workers=args.workers,
+        max_statements=args.max_statements,
+        coverage=args.coverage,
+        edges=args.edges,
+        batch_size=args.batch_size,
+        sync_schema=args.sync_schema,
+        session_size=args.session_size,
+        timeout=args.timeout,
+        dedup_size=args.dedup,
+    )
+    experiment = Experiment(**experiment_kwargs, measure_only=args.jobs > 1)
+    try:
+        if args.duration is not None:
+            experiment.run_campaign(
+                args.duration, args.checkpoint_interval, args.state_dir, args.resume
+            )
+        elif args.jobs > 1:
+            experiment.generate_and_run_k_parallel(
+                runs, plot_every_x, args.jobs, **experiment_kwargs
+            )
+        else:
+            experiment.generate_and_run_k_plot_coverage(runs, plot_every_x)
+    finally:
+        experiment.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+static int classify(int x)
+{
+    if (x < 0)
+        return -1;
+    else if (x == 0)
+        return 0;
+    return x % 2 ? 1 : 2;
+}
+
+static int never_called(int x)
+{
+    while (x > 1)
+        x = x % 2 ? 3 * x + 1 : x / 2;
+    return x;
+}
+
+int main(int argc, char **argv)
+{
+    int total = 0;
+    for (int i = 1; i < argc; i++) {
+        int x = atoi(argv[i]);
+        switch (classify(x)) {
+        case -1:
+            total -= x;
+            break;
+        case 1:
+            total += x;
+            break;
+        default:
+            break;
+        }
+    }
+    if (argc > 5 && total > 100)
+        total = never_called(total);
+    printf("%d\n", total);
+    return 0;
+}
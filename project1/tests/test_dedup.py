@@ -0,0 +1,55 @@
+from fuzzer import InputDedup
+
+
+def test_literals():
+    normalize = InputDedup.normalize
+    assert normalize("SELECT 'abc', 'it''s', 42, 4.5e3, 0x1F") == (
+        "SELECT '', '', #2, #5, #4"
+    )
+    assert normalize("SELECT 'a'") == normalize("SELECT 'a longer string'")
+    assert normalize("SELECT 17") == normalize("SELECT 99")
+    # Numbers of different lengths stay apart.
+    assert normalize("SELECT 0") != normalize("SELECT 9223372036854775807")
+
+
+def test_identifiers():
+    normalize = InputDedup.normalize
+    assert normalize("DELETE FROM mXyZabcQ WHERE aBcDeFg = 1") == (
+        "DELETE FROM x WHERE x = #1"
+    )
+    assert normalize("SELECT qWeRtY FROM AsDfGh") == normalize(
+        "SELECT zXcVbN FROM PoIuYt"
+    )
+    # Keywords, functions, pragmas and collations are kept.
+    assert normalize("SELECT abs(1)") != normalize("SELECT hex(1)")
+    assert normalize("PRAGMA cache_size") != normalize("PRAGMA page_size")
+    assert normalize("SELECT 1 COLLATE NOCASE") != normalize("SELECT 1 COLLATE RTRIM")
+
+
+def test_add():
+    dedup = InputDedup()
+    assert dedup.add("SELECT aBcD FROM eFgH WHERE iJ = 'x'")
+    assert not dedup.add("SELECT kLmN FROM oPqR WHERE sT = 'y'")
+    assert dedup.add("SELECT aBcD FROM eFgH WHERE iJ = 12")
+    assert dedup.duplicates == 1
+
+
+def test_schema_statements_always_run():
+    dedup = InputDedup()
+    for _ in range(2):
+        assert dedup.add("CREATE TABLE aBcD (eFgH INTEGER)")
+        assert dedup.add("DROP TABLE aBcD")
+        assert dedup.add("BEGIN")
+        assert dedup.add("")
+    assert dedup.duplicates == 0
+
+
+def test_least_recently_seen_are_forgotten():
+    dedup = InputDedup(size=2)
+    a, b, c = "SELECT 1", "SELECT 'a'", "SELECT abs(1)"
+    assert dedup.add(a) and dedup.add(b)
+    # Seeing a again makes b the least recently seen.
+    assert not dedup.add(a)
+    assert dedup.add(c)
+    assert not dedup.add(a)
+    assert dedup.add(b)
@@ -0,0 +1,39 @@
+import os
+
+from run import GcovReader
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# branches.gcno and the .gcda files come from
+#   gcc --coverage -O0 -c branches.c && gcc --coverage branches.o -o branches
+# with `./branches 3 4` for first.gcda and `./branches -5 0 7 8 9 200` for
+# second.gcda. The expected numbers are what
+#   gcovr --csv --branches --exclude-unreachable-branches
+# reports for the same counters.
+
+
+def read(*names):
+    reader = GcovReader(os.path.join(DATA, "branches.gcno"), source="branches.c")
+    return reader.get_coverage([os.path.join(DATA, name) for name in names])
+
+
+def test_gcovr_parity():
+    assert read("first.gcda") == (0.474, 9, 19)
+    assert read("second.gcda") == (0.684, 13, 19)
+
+
+def test_summed_counters():
+    # Like gcov-tool merge of both runs, or running both on one .gcda file.
+    assert read("first.gcda", "second.gcda") == (0.737, 14, 19)
+
+
+def test_missing_counters():
+    assert read("missing.gcda") == (0, 0, 19)
+
+
+def test_cached_functions():
+    reader = GcovReader(os.path.join(DATA, "branches.gcno"), source="branches.c")
+    files = [os.path.join(DATA, name) for name in ["first.gcda", "second.gcda"]]
+    assert reader.get_coverage(files[:1]) == (0.474, 9, 19)
+    assert reader.get_coverage(files) == (0.737, 14, 19)
+    assert reader.get_coverage(files[:1]) == (0.474, 9, 19)
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from run import LibraryWorker, SQLiteWorker, SQLiteWorkerPool
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQLITE3 = os.path.join(PROJECT_DIR, "sqlite3")
+LIBRARY = os.path.join(PROJECT_DIR, "libsqlite3.so")
+
+needs_sqlite3 = pytest.mark.skipif(
+    not os.path.exists(SQLITE3), reason="sqlite3 is not built, run make"
+)
+needs_library = pytest.mark.skipif(
+    not os.path.exists(LIBRARY), reason="run make libsqlite3.so"
+)
+
+
+@needs_sqlite3
+def test_large_batch():
+    # Both the batch and its output are larger than the pipe buffers.
+    sqlcmds = [f"SELECT hex(randomblob(100)) AS c{i};" for i in range(1000)]
+    worker = SQLiteWorker(SQLITE3, ":memory:", max_statements=10000, timeout=10)
+    try:
+        worker.send_batch(sqlcmds)
+        results = worker.receive_batch()
+    finally:
+        worker.stop()
+    assert [sqlcmd for sqlcmd, _, _ in results] == sqlcmds
+    assert all(len(output) > 200 for _, output, _ in results)
+
+
+@needs_sqlite3
+def test_pool_large_batches(tmp_path):
+    db_files = [str(tmp_path / "a.db"), str(tmp_path / "b.db")]
+    pool = SQLiteWorkerPool(SQLITE3, db_files, max_statements=10000)
+    sqlcmds = [f"SELECT {i}, hex(randomblob(100));" for i in range(1000)]
+    done = []
+    for _ in range(3):
+        done += pool.submit_batch(sqlcmds)
+    done += pool.stop()
+    assert len(done) == 3000
+    for sqlcmd, output, _ in done:
+        assert output.startswith(sqlcmd.split()[1].rstrip(",").encode() + b"|")
+
+
+@needs_library
+def test_library_open_error(tmp_path):
+    worker = LibraryWorker(LIBRARY, str(tmp_path / "missing" / "a.db"))
+    worker.send_batch(["SELECT 1;"])
+    with pytest.raises(RuntimeError, match="cannot open"):
+        worker.receive_batch()
+    assert worker.process is None
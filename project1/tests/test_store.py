@@ -0,0 +1,136 @@
+from grammar import Store, TableRecord
+
+
+def snapshot(store):
+    return (
+        {
+            name: (
+                table.has_primary_key,
+                set(table.columns),
+                dict(table.types),
+                set(table.indices),
+            )
+            for name, table in store.store.items()
+        },
+        set(store.tables),
+        set(store.indexed_tables),
+    )
+
+
+def make_store():
+    store = Store()
+    store.set_table("t1", TableRecord())
+    store.add_column("t1", "a", "INTEGER")
+    store.add_column("t1", "b")
+    store.add_index("t1", "i1")
+    store.set_table("t2", TableRecord(has_primary_key=False))
+    return store
+
+
+def change_schema(store):
+    store.set_table("t3", TableRecord())
+    store.add_column("t3", "c", "TEXT")
+    store.add_column("t1", "d")
+    store.remove_column("t1", "a")
+    store.set_column_type("t1", "b", "BLOB")
+    store.set_primary_key("t2", True)
+    store.remove_index("t1", "i1")
+    store.add_index("t2", "i2")
+    store.rename_table("t2", "t4")
+    store.remove_table("t3")
+
+
+def test_rollback_to_savepoint():
+    store = make_store()
+    before = snapshot(store)
+    store.savepoint("s1")
+    change_schema(store)
+    assert snapshot(store) != before
+    store.rollback("s1")
+    assert snapshot(store) == before
+    # ROLLBACK TO keeps the savepoint open.
+    assert store.find_savepoint("s1") == 0
+    store.add_column("t1", "e")
+    store.rollback("s1")
+    assert snapshot(store) == before
+
+
+def test_nested_savepoints():
+    store = make_store()
+    before = snapshot(store)
+    store.savepoint("s1")
+    store.add_column("t1", "c")
+    middle = snapshot(store)
+    store.savepoint("s2")
+    change_schema(store)
+    store.rollback("s2")
+    assert snapshot(store) == middle
+    # After RELEASE the changes of s2 belong to s1.
+    change_schema(store)
+    store.release("s2")
+    assert store.find_savepoint("s2") is None
+    assert snapshot(store) != middle
+    store.rollback("s1")
+    assert snapshot(store) == before
+
+
+def test_savepoint_names_repeat():
+    store = make_store()
+    store.savepoint("s")
+    store.add_column("t1", "c")
+    middle = snapshot(store)
+    store.savepoint("s")
+    change_schema(store)
+    # The innermost savepoint of that name is meant.
+    store.rollback("s")
+    assert snapshot(store) == middle
+    assert len(store.savepoints) == 2
+
+
+def test_release_outermost_savepoint_commits():
+    store = make_store()
+    store.savepoint("s1")
+    change_schema(store)
+    after = snapshot(store)
+    store.release("s1")
+    assert store.savepoints == [] and store.journal == []
+    store.rollback()
+    assert snapshot(store) == after
+
+
+def test_begin_rollback():
+    store = make_store()
+    before = snapshot(store)
+    store.begin()
+    store.savepoint("s1")
+    change_schema(store)
+    store.rollback()
+    assert snapshot(store) == before
+    assert store.savepoints == [] and store.journal == []
+
+
+def test_commit_keeps_changes():
+    store = make_store()
+    store.begin()
+    change_schema(store)
+    after = snapshot(store)
+    store.commit()
+    store.rollback()
+    assert snapshot(store) == after
+
+
+def test_unknown_savepoint():
+    store = make_store()
+    store.savepoint("s1")
+    change_schema(store)
+    after = snapshot(store)
+    store.rollback("missing")
+    store.release("missing")
+    assert snapshot(store) == after
+    assert store.find_savepoint("s1") == 0
+
+
+def test_no_journal_outside_transactions():
+    store = make_store()
+    change_schema(store)
+    assert store.journal == []